@@ -3,13 +3,24 @@ This file contains the api endpoints build using REST through Fastapi
 
 """
 
-from fastapi import FastAPI,HTTPException, Request, Depends
-from fastapi.responses import JSONResponse
-from sqlalchemy import select
-
-from blockchain import BlockChain
+import asyncio
+import gzip
+import json
+import time
+
+from fastapi import FastAPI,HTTPException, Request, Depends, Query
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+
+from blockchain import BlockChain, CHAIN_PAGE_SIZE, MAX_HEADERS, MAX_TRANSACTION_BATCH, HISTORY_PAGE_SIZE, MINER_AUTOSTART
+from encoding import key_fingerprint, transaction_id
+from keys import KEY_TYPES, WALLET_KEY_TYPE
+import metrics
+from signatures import signed_fields
+from snapshot import SNAPSHOT_MEDIA_TYPE, export_snapshot
+from cache import CachedResponse, etag_matches
+from wire import CHAIN_MEDIA_TYPE, ChainEncoder
 from fastapi.middleware.cors import CORSMiddleware
-from db import Wallet, Node, Transaction, Block, create_db_and_tableS,get_async_session
+from db import Wallet, Node, Block, create_db_and_tableS,get_async_session, async_session_maker, engine
 from sqlalchemy.ext.asyncio import AsyncSession
 from contextlib import asynccontextmanager
 
@@ -17,9 +28,25 @@ from contextlib import asynccontextmanager
 @asynccontextmanager
 async def lifespan(app:FastAPI):
     await create_db_and_tableS()
+    async with async_session_maker() as session:
+        await blockchain.load_state(session)
+    blockchain.keys.start()
+    if MINER_AUTOSTART:
+        blockchain.start_mining(async_session_maker)
     yield
+    await blockchain.stop_mining()
+    blockchain.keys.shutdown()
+    blockchain.miner.shutdown()
+    blockchain.validator.shutdown()
+    blockchain.verifier.shutdown()
+    if blockchain.store is not None:
+        blockchain.store.close()
+    await blockchain.aclose()
 app = FastAPI(lifespan=lifespan)
 
+#Largest page /wallet/history will return
+MAX_HISTORY_PAGE_SIZE = 500
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -32,13 +59,60 @@ app.add_middleware(
 blockchain = BlockChain()
 node_identifier: str | None = None
 
+metrics.instrument_engine(engine.sync_engine)
+metrics.gauge("blockchain_chain_height", "Height of our chain", lambda: blockchain.height)
+metrics.gauge("blockchain_mempool_transactions", "Transactions waiting to be mined", lambda: len(blockchain.mempool))
+metrics.gauge("blockchain_response_cache_bytes", "Size of the cached response bodies",
+              lambda: blockchain.cache.size_bytes)
+metrics.gauge("blockchain_miner_running", "1 while the background miner is running", lambda: int(blockchain.mining))
+metrics.gauge("blockchain_key_pool_available", "Pregenerated keypairs ready for new wallets",
+              lambda: sum(blockchain.keys.available(key_type) for key_type in KEY_TYPES))
+
+if metrics.TRACE_REQUESTS:
+    @app.middleware("http")
+    async def trace_requests(request: Request, call_next):
+        started = time.perf_counter()
+        response = await call_next(request)
+        elapsed = time.perf_counter() - started
+
+        #the route's template, so /blocks/{block_hash} is one series rather than one per hash
+        route = request.scope.get('route')
+        path = route.path if route is not None else "unmatched"
+        metrics.HTTP_REQUEST_SECONDS.observe(elapsed, request.method, path, str(response.status_code))
+        response.headers["Server-Timing"] = f"app;dur={elapsed * 1000:.3f}"
+        return response
+
+def not_modified_response(request: Request, key: tuple, headers: dict[str, str] | None = None) -> Response | None:
+    """
+    Answers 304 if the client already holds the body for this key. The ETag comes from the key alone, so
+    this needs neither the cache entry nor the body
+    """
+    etag = blockchain.cache.etag(key)
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers={**(headers or {}), "ETag": etag})
+    return None
+
+def cached_response(entry: CachedResponse) -> Response:
+    return Response(entry.body, status_code=200, media_type=entry.media_type,
+                    headers={**entry.headers, "ETag": entry.etag})
+
+@app.get('/metrics')
+async def metrics_endpoint():
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(metrics.registry.render(), status_code=200, media_type=metrics.CONTENT_TYPE)
+
 @app.post("/wallet/create")
 async def create_wallet(
+        key_type: str = Query(WALLET_KEY_TYPE),
         session: AsyncSession = Depends(get_async_session),
 ):
     global node_identifier
 
-    public_key, private_key = blockchain.create_wallets()
+    if key_type not in KEY_TYPES:
+        raise HTTPException(status_code=400, detail=f"key_type must be one of {', '.join(KEY_TYPES)}")
+
+    public_key, private_key = await blockchain.keys.take(key_type)
     node_identifier = public_key
 
     existing = await session.get(Wallet, public_key)
@@ -69,20 +143,20 @@ async def mine(
         last_proof = 100
         previous_hash = "1"
     else:
-        last_proof = last_block['proof']
-        previous_hash = last_block['previous_hash']
-
-    proof = blockchain.proof_of_work(last_proof)
+        last_proof = last_block.proof
+        previous_hash = last_block.hash
 
-    await blockchain.new_transaction(
-        session,
-        sender="0",
-        recipient=node_identifier,
-        amount=1,
-        signature=None,
-    )
+    difficulty = await blockchain.next_difficulty(session)
+    proof = await blockchain.proof_of_work(last_proof, difficulty)
+    if proof is None:
+        return JSONResponse(
+            content={"status" : "Error", "message" : "Mining cancelled, the chain was replaced"}, status_code=409
+        )
 
-    block = await blockchain.new_block(session, proof, previous_hash)
+    try:
+        block = await blockchain.new_block(session, proof, previous_hash, difficulty, node_identifier)
+    except ValueError as e:
+        return JSONResponse(content={"status" : "Error", "message" : str(e)}, status_code=409)
 
     response = {
         "message": "New Block Forged",
@@ -90,10 +164,36 @@ async def mine(
         "transactions": block['transactions'],
         "proof": block['proof'],
         "previous_hash": block['previous_hash'],
+        "difficulty": block['difficulty'],
+        "hash": block['hash'],
     }
 
     return JSONResponse(response, status_code=200)
 
+@app.post('/miner/start')
+async def start_miner(request : Request):
+    data = await request.json() if await request.body() else {}
+    reward_address = data.get('reward_address') if isinstance(data, dict) else None
+    if reward_address is not None and not isinstance(reward_address, str):
+        raise HTTPException(status_code=400, detail="reward_address must be a public key")
+
+    #without one the rewards keep going where they went, or to the last wallet created
+    try:
+        blockchain.start_mining(async_session_maker, reward_address or blockchain.reward_address or node_identifier)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return JSONResponse(blockchain.mining_status(), status_code=200)
+
+@app.post('/miner/stop')
+async def stop_miner():
+    await blockchain.stop_mining()
+    return JSONResponse(blockchain.mining_status(), status_code=200)
+
+@app.get('/miner/status')
+async def miner_status():
+    return JSONResponse(blockchain.mining_status(), status_code=200)
+
 @app.post('/new_transaction')
 async def new_transaction(request : Request, session : AsyncSession = Depends(get_async_session)):
     data = await request.json()
@@ -102,11 +202,9 @@ async def new_transaction(request : Request, session : AsyncSession = Depends(ge
     if not all (k in data for k in required):
         raise HTTPException(status_code=400,detail="Missing values")
 
-    new_transaction = {
-        'sender': data['sender'],
-        'recipient': data['recipient'],
-        'amount': data['amount'],
-    }
+    fee = data.get('fee', 0.0)
+
+    new_transaction = signed_fields(data)
     signature = data['signature']
 
     if not blockchain.verify_transaction(data['sender'], new_transaction, signature):
@@ -119,24 +217,241 @@ async def new_transaction(request : Request, session : AsyncSession = Depends(ge
             recipient= data['recipient'],
             amount=data['amount'],
             signature = signature,
+            fee = fee,
     )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
-    response = {"Message": f"Transaction added to Blockchain {index}"}
+    response = {"Message": f"Transaction added to Blockchain {index}", "tx_id": transaction_id(data)}
+
+    return JSONResponse(response, status_code=200)
+
+@app.post('/transactions/batch')
+async def new_transactions(request : Request, session : AsyncSession = Depends(get_async_session)):
+    data = await request.json()
+    transactions = data.get('transactions') if isinstance(data, dict) else None
+    if not isinstance(transactions, list) or len(transactions) > MAX_TRANSACTION_BATCH:
+        raise HTTPException(status_code=400,
+                            detail=f"Please supply a list of at most {MAX_TRANSACTION_BATCH} transactions")
+
+    #Check that the required values are present in each transaction, the rest are verified together
+    required = ['sender', 'recipient', 'amount', 'signature']
+    results: list[dict | None] = [None] * len(transactions)
+    to_verify: list[int] = []
+
+    for i, t in enumerate(transactions):
+        if not isinstance(t, dict) or not all(k in t for k in required):
+            results[i] = {"status": "rejected", "message": "Missing values"}
+        elif blockchain.transaction_seen(t['signature']):
+            #peers relay what they accept, so copies of transactions we already have are common
+            results[i] = {"status": "rejected", "message": "Transaction already seen"}
+        else:
+            to_verify.append(i)
+
+    verified = await blockchain.verifier.verify_batch([
+        (transactions[i]['sender'], signed_fields(transactions[i]), transactions[i]['signature'])
+        for i in to_verify
+    ])
+
+    accepted = 0
+    for i, valid in zip(to_verify, verified):
+        t = transactions[i]
+        if not valid:
+            results[i] = {"status": "rejected", "message": "Invalid transaction"}
+            continue
+
+        try:
+            index = await blockchain.new_transaction(
+                session,
+                sender = t['sender'],
+                recipient= t['recipient'],
+                amount=t['amount'],
+                signature = t['signature'],
+                fee = t.get('fee', 0.0),
+            )
+        except ValueError as e:
+            results[i] = {"status": "rejected", "message": str(e)}
+            continue
+
+        accepted += 1
+        results[i] = {"status": "accepted", "block": index, "tx_id": transaction_id(t)}
+
+    response = {"accepted": accepted, "results": results}
 
     return JSONResponse(response, status_code=200)
 
 @app.get('/chain')
-async def full_chain(session : AsyncSession = Depends(get_async_session)):
-    chain = await blockchain.get_chain(session)
+async def full_chain(
+        request: Request,
+        from_index: int = Query(1, ge=1),
+        limit: int | None = Query(None, ge=1),
+        stream: bool = False,
+        session : AsyncSession = Depends(get_async_session),
+):
+    if stream and blockchain.store is not None:
+        async def ndjson_from_store():
+            stop = blockchain.store.height if limit is None else from_index + limit - 1
+            for start in range(from_index, stop + 1, CHAIN_PAGE_SIZE):
+                records = blockchain.encoded_chain(start, min(CHAIN_PAGE_SIZE, stop + 1 - start))
+                if not records:
+                    break
+                yield b"\n".join(records) + b"\n"
+
+        return StreamingResponse(ndjson_from_store(), media_type="application/x-ndjson")
+
+    if stream:
+        #the stream outlives this request's session, so it opens its own
+        async def ndjson():
+            async with async_session_maker() as stream_session:
+                async for block in blockchain.iter_chain(stream_session, from_index, limit):
+                    yield json.dumps(block) + "\n"
+
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    tip = await blockchain.last_block(session)
+    length = tip.index if tip is not None else 0
+
+    #peers ask for the binary encoding, everyone else gets JSON
+    binary = CHAIN_MEDIA_TYPE in request.headers.get('accept', '')
+    gzipped = binary and 'gzip' in request.headers.get('accept-encoding', '')
+    key = ("chain", tip.hash if tip is not None else None, from_index, limit, binary, gzipped)
+    headers = {"Vary": "Accept, Accept-Encoding"}
+
+    not_modified = not_modified_response(request, key, headers)
+    if not_modified is not None:
+        return not_modified
+
+    entry = blockchain.cache.get(key)
+    if entry is not None:
+        return cached_response(entry)
+    generation = blockchain.cache.generation
+
+    if binary:
+        chain = await blockchain.get_chain(session, from_index, limit)
+        next_index = chain[-1]['index'] + 1 if chain and chain[-1]['index'] < length else None
+        body = ChainEncoder().encode(chain, length, next_index)
+
+        if gzipped:
+            body = await asyncio.to_thread(gzip.compress, body, 6)
+            headers["Content-Encoding"] = "gzip"
+        return cached_response(blockchain.cache.put(key, body, CHAIN_MEDIA_TYPE, headers, generation))
+
+    encoded = blockchain.encoded_chain(from_index, limit)
+    if encoded is not None:
+        #the stored encodings are spliced into the response as they are, without decoding them
+        last_index = from_index + len(encoded) - 1
+        next_index = last_index + 1 if encoded and last_index < length else None
+        body = b'{"chain":[' + b','.join(encoded) + b'],"length":' + str(length).encode() \
+            + b',"next_index":' + json.dumps(next_index).encode() + b'}'
+        return cached_response(blockchain.cache.put(key, body, headers=headers, generation=generation))
+
+    chain = await blockchain.get_chain(session, from_index, limit)
+
+    next_index = None
+    if chain and chain[-1]['index'] < length:
+        next_index = chain[-1]['index'] + 1
+
     response = {
         'chain': chain,
-        'length': len(chain),
+        'length': length,
+        'next_index': next_index,
+    }
+    body = JSONResponse(response).body
+    return cached_response(blockchain.cache.put(key, body, headers=headers, generation=generation))
+
+@app.get('/snapshot')
+async def chain_snapshot(
+        height: int | None = Query(None, ge=1),
+        session : AsyncSession = Depends(get_async_session),
+):
+    tip = await blockchain.last_block(session)
+    length = tip.index if tip is not None else 0
+    if length == 0 or (height is not None and height > length):
+        raise HTTPException(status_code=400, detail=f"height must be from 1 to {length}")
+    height = height or length
+
+    #the stream outlives this request's session, so it opens its own
+    async def gzipped():
+        async with async_session_maker() as snapshot_session:
+            async for chunk in export_snapshot(blockchain, snapshot_session, height):
+                yield chunk
+
+    headers = {"Content-Disposition": f'attachment; filename="snapshot-{height}.ndjson.gz"'}
+    return StreamingResponse(gzipped(), media_type=SNAPSHOT_MEDIA_TYPE, headers=headers)
+
+@app.get('/chain/length')
+async def chain_length(session : AsyncSession = Depends(get_async_session)):
+    tip = await blockchain.last_block(session)
+
+    response = {
+        'length': tip.index if tip is not None else 0,
+        'tip_hash': tip.hash if tip is not None else None,
+    }
+    return JSONResponse(response, status_code=200)
+
+@app.get('/chain/headers')
+async def chain_headers(
+        from_index: int = Query(1, ge=1, alias='from'),
+        limit: int = Query(MAX_HEADERS, ge=1, le=MAX_HEADERS),
+        session : AsyncSession = Depends(get_async_session),
+):
+    headers = await blockchain.get_headers(session, from_index, limit)
+    response = {
+        'headers': headers,
+        'length': len(headers),
+    }
+    return JSONResponse(response, status_code=200)
+
+@app.get('/chain/audit')
+async def chain_audit(session : AsyncSession = Depends(get_async_session)):
+    first_invalid = await blockchain.audit(session)
+
+    response = {
+        'valid': first_invalid is None,
+        'first_invalid_index': first_invalid,
     }
     return JSONResponse(response, status_code=200)
 
+@app.get('/blocks/{block_hash}')
+async def block_by_hash(block_hash: str, session : AsyncSession = Depends(get_async_session)):
+    block = await blockchain.get_block_by_hash(session, block_hash)
+    if block is None:
+        raise HTTPException(status_code=404, detail="Block not found")
+
+    return JSONResponse(block, status_code=200)
+
+@app.post('/blocks/announce')
+async def block_announcement(request : Request, session : AsyncSession = Depends(get_async_session)):
+    data = await request.json()
+    block = data.get('block') if isinstance(data, dict) else None
+    if not isinstance(block, dict):
+        raise HTTPException(status_code=400, detail="Missing block")
+
+    node = data.get('node') if isinstance(data.get('node'), str) else None
+    status = await blockchain.receive_block(session, block)
+
+    if status == "appended":
+        #passed on to our own peers, the seen hashes stop it going round in circles
+        await blockchain.announce_block(session, block, exclude=node)
+    elif status == "sync":
+        #the sync outlives this request's session, so it opens its own
+        async def catch_up():
+            async with async_session_maker() as sync_session:
+                await blockchain.catch_up(sync_session, node, block['index'])
+
+        blockchain.spawn(catch_up())
+
+    return JSONResponse({"status": status}, status_code=200)
+
+@app.get('/transactions/{tx_id}/proof')
+async def transaction_proof(tx_id: str, session : AsyncSession = Depends(get_async_session)):
+    proof = await blockchain.transaction_proof(session, tx_id)
+    if proof is None:
+        raise HTTPException(status_code=404, detail="Transaction not found in any block")
+
+    return JSONResponse(proof, status_code=200)
+
 @app.post('/nodes/register')
 async def register_nodes(request : Request, session : AsyncSession = Depends(get_async_session)):
     values = await request.json()
@@ -162,28 +477,43 @@ async def resolve(
         session : AsyncSession = Depends(get_async_session),
 ):
     replaced = await blockchain.resolve_conflicts(session)
-    chain = await blockchain.get_chain(session)
+
+    #the chain is serialised once per tip, polling nodes get the cached bytes spliced in
+    tip = await blockchain.last_block(session)
+    key = ("chain-list", tip.hash if tip is not None else None)
+    entry = blockchain.cache.get(key)
+    if entry is None:
+        generation = blockchain.cache.generation
+        chain = await blockchain.get_chain(session)
+        entry = blockchain.cache.put(key, JSONResponse(chain).body, generation=generation)
 
     if replaced:
-        response = {
-            'message': 'Longest Chain Updated',
-            'new_chain': chain,
-        }
+        body = b'{"message":"Longest Chain Updated","new_chain":' + entry.body + b'}'
     else:
-        response = {
-            'message': 'No Longest Chain Available',
-            'chain': chain,
-        }
+        body = b'{"message":"No Longest Chain Available","chain":' + entry.body + b'}'
 
-    return JSONResponse(response, status_code=200)
+    return Response(body, status_code=200, media_type="application/json")
 
 @app.get('/wallet/details/')
-async def wallet(session : AsyncSession = Depends(get_async_session),):
+async def wallet(request : Request, session : AsyncSession = Depends(get_async_session),):
     if node_identifier is None:
         return JSONResponse(
             content={"status" : "error", "message": "Wallet not found"},
         )
 
+    #balances only move with the chain, and history only with new blocks
+    tip = await blockchain.last_block(session)
+    key = ("wallet", node_identifier, tip.hash if tip is not None else None, blockchain.mempool.version)
+
+    not_modified = not_modified_response(request, key)
+    if not_modified is not None:
+        return not_modified
+
+    entry = blockchain.cache.get(key)
+    if entry is not None:
+        return cached_response(entry)
+    generation = blockchain.cache.generation
+
     wallet = await session.get(Wallet, node_identifier)
 
     if wallet is None:
@@ -191,19 +521,7 @@ async def wallet(session : AsyncSession = Depends(get_async_session),):
             content={"status" : "error", "message": "Wallet not found"},
         )
 
-    result = await session.execute(select(Transaction).where(Transaction.sender == node_identifier,
-                Transaction.recipient == node_identifier))
-
-    transactions = [{
-        "id" : t.id,
-        "block_id" : t.block_id,
-        "sender": t.sender,
-        "recipient" : t.recipient,
-        "amount" : t.amount,
-        "signatur": t.signature,
-
-    } for t in result.scalars().all()
-    ]
+    transactions = await blockchain.wallet_history(session, key_fingerprint(node_identifier))
 
     response = {
         "publicKey": node_identifier,
@@ -211,8 +529,31 @@ async def wallet(session : AsyncSession = Depends(get_async_session),):
         "transactions": transactions,
     }
 
-    return JSONResponse(content = {"status":"success", "data":response}, status_code=200)
+    body = JSONResponse(content = {"status":"success", "data":response}).body
+    return cached_response(blockchain.cache.put(key, body, generation=generation))
 
+@app.get('/wallet/history')
+async def wallet_history(
+        public_key: str | None = None,
+        fingerprint: str | None = None,
+        after_id: int = Query(0, ge=0),
+        limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=MAX_HISTORY_PAGE_SIZE),
+        session : AsyncSession = Depends(get_async_session),
+):
+    if fingerprint is None:
+        if public_key is None:
+            raise HTTPException(status_code=400, detail="Please supply a public_key or fingerprint")
+        fingerprint = key_fingerprint(public_key)
+
+    transactions = await blockchain.wallet_history(session, fingerprint, after_id, limit)
+
+    response = {
+        "fingerprint": fingerprint,
+        "transactions": transactions,
+        "next_after_id": transactions[-1]['id'] if len(transactions) == limit else None,
+    }
+
+    return JSONResponse(content = {"status":"success", "data":response}, status_code=200)
 
 @app.get('/')
 async def root():
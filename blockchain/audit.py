@@ -0,0 +1,33 @@
+"""
+Self-audit command: re-validates the local chain in the DB and reports the first invalid block
+
+Usage: python audit.py
+"""
+import asyncio
+import sys
+
+from blockchain import BlockChain
+from db import async_session_maker, create_db_and_tableS
+
+
+async def main() -> int:
+    await create_db_and_tableS()
+    #the DB is audited directly, the block store is only a copy of it
+    blockchain = BlockChain(block_store_dir=None)
+
+    try:
+        async with async_session_maker() as session:
+            first_invalid = await blockchain.audit(session)
+    finally:
+        blockchain.validator.shutdown()
+
+    if first_invalid is None:
+        print("Chain is valid")
+        return 0
+
+    print(f"Chain is invalid from block {first_invalid}")
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
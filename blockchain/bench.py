@@ -0,0 +1,529 @@
+"""
+Load tests for the node, run against the FastAPI app in process with a throwaway database. Peers are run
+as separate uvicorn processes, each with its own scratch database. Every scenario prints one JSON object.
+
+Usage: python bench.py double-spend [--requests N] [--concurrency N]
+       python bench.py storage [--requests N] [--concurrency N] [--database-url URL ...]
+       python bench.py mining [--blocks N]
+       python bench.py chain-reads [--height N] [--density N] [--requests N] [--concurrency N]
+       python bench.py sync [--height N] [--density N] [--peers N]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:
+    #not available on Windows, peak RSS is left out there
+    resource = None
+
+#Times the whole chain is read in the chain-reads scenario, on top of the paged reads
+FULL_CHAIN_READS = 20
+
+#Seconds a peer process gets to start answering requests
+PEER_START_TIMEOUT = 30
+
+
+def percentile(samples: list[float], q: float) -> float:
+    """
+    Returns the q-th percentile (0-100) of the samples, by nearest rank
+    """
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+def peak_rss() -> dict:
+    """
+    Returns the peak resident set size of this process, and of the largest child it waited for, in MB.
+    Children include the worker pools and peer nodes, which have all exited by the time this is called
+    """
+    if resource is None:
+        return {}
+    return {
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children_peak_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+async def seed_chain(height: int, density: int) -> list[dict]:
+    """
+    Builds a valid chain of `height` blocks, each after the first carrying `density` signed transactions
+    besides its reward. The timestamps are TARGET_BLOCK_TIME apart and end now, so the difficulty never
+    retargets and any height can be mined at INITIAL_DIFFICULTY.
+    """
+    from blockchain import MINING_REWARD
+    from difficulty import INITIAL_DIFFICULTY, TARGET_BLOCK_TIME
+    from encoding import block_header, time_format, transactions_root
+    from keys import generate_keypair
+    from miner import Miner
+    from signatures import sign, signed_fields
+
+    #the sender mines the first block, which pays for every transaction after it
+    sender, private_key = generate_keypair("ed25519")
+    recipient, _ = generate_keypair("ed25519")
+    amount = 0.5 / max(1, (height - 1) * density)
+    start = datetime.utcnow() - timedelta(seconds=TARGET_BLOCK_TIME * height)
+
+    miner = Miner()
+    chain = []
+    last_proof, previous_hash = 100, "1"
+    try:
+        for index in range(1, height + 1):
+            proof = await miner.proof_of_work(last_proof, INITIAL_DIFFICULTY)
+
+            transactions = []
+            for i in range(density if index > 1 else 0):
+                #the fee keeps every transaction distinct
+                transaction = {"sender": sender, "recipient": recipient, "amount": amount,
+                               "fee": (index * density + i) * 1e-12}
+                transactions.append({**transaction, "signature": sign(private_key, signed_fields(transaction))})
+
+            reward = {"sender": "0", "recipient": sender, "amount": MINING_REWARD + sum(t['fee'] for t in transactions),
+                      "fee": 0.0, "signature": None}
+            block = {
+                "index": index,
+                "timestamp": time_format(start + timedelta(seconds=TARGET_BLOCK_TIME * index)),
+                "transactions": [reward] + transactions,
+                "proof": proof,
+                "previous_hash": previous_hash,
+                "difficulty": INITIAL_DIFFICULTY,
+            }
+            block['merkle_root'] = transactions_root(block)
+            block['hash'] = hashlib.sha256(block_header(block, block['merkle_root'])).hexdigest()
+
+            chain.append(block)
+            last_proof, previous_hash = proof, block['hash']
+    finally:
+        miner.shutdown()
+
+    return chain
+
+
+async def announce_chain(client, chain: list[dict]) -> None:
+    """
+    Hands a node the chain one block at a time, through the same path as blocks announced by peers
+    """
+    for block in chain:
+        response = await client.post('/blocks/announce', json={"block": block})
+        response.raise_for_status()
+        if response.json()['status'] != "appended":
+            raise RuntimeError(f"Block {block['index']} was {response.json()['status']}")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@asynccontextmanager
+async def run_peers(count: int):
+    """
+    Starts `count` nodes with uvicorn, each in its own process and scratch directory since db.py binds one
+    database per process. Peers always use SQLite, whatever BLOCKCHAIN_DATABASE_URL says.
+    :return: <list> The peers' addresses, Eg: 'http://127.0.0.1:5001'
+    """
+    import httpx
+
+    source = os.path.dirname(os.path.abspath(__file__))
+    processes = []
+    urls = []
+    try:
+        for _ in range(count):
+            directory = tempfile.mkdtemp(prefix="blockchain-peer-")
+            port = free_port()
+            env = {key: value for key, value in os.environ.items() if key != "BLOCKCHAIN_DATABASE_URL"}
+            env.update(PYTHONPATH=source, BLOCKCHAIN_NODE_ADDRESS=f"127.0.0.1:{port}")
+            if "BLOCKCHAIN_BLOCK_STORE" in env:
+                env["BLOCKCHAIN_BLOCK_STORE"] = os.path.join(directory, "blocks")
+
+            processes.append(subprocess.Popen(
+                [sys.executable, '-m', 'uvicorn', 'api:app', '--host', '127.0.0.1', '--port', str(port),
+                 '--log-level', 'warning'],
+                cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            ))
+            urls.append(f"http://127.0.0.1:{port}")
+
+        async with httpx.AsyncClient() as client:
+            for url, process in zip(urls, processes):
+                deadline = time.monotonic() + PEER_START_TIMEOUT
+                while True:
+                    if process.poll() is not None:
+                        raise RuntimeError(f"Peer {url} exited with {process.returncode}")
+                    try:
+                        (await client.get(f"{url}/chain/length")).raise_for_status()
+                        break
+                    except httpx.HTTPError:
+                        if time.monotonic() > deadline:
+                            raise RuntimeError(f"Peer {url} did not start")
+                        await asyncio.sleep(0.1)
+
+        yield urls
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=PEER_START_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+
+async def double_spend(args: argparse.Namespace) -> dict:
+    """
+    Funds one wallet by mining, then fires `requests` signed transactions from it at once, each spending
+    a fixed share of twice what it holds. No more than its balance may be accepted, and after mining them
+    the wallet must be down by exactly what was accepted.
+    """
+    import httpx
+    from api import app, blockchain
+    from db import Wallet, async_session_maker
+    from signatures import signed_fields
+
+    requests, concurrency = args.requests, args.concurrency
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            wallet = (await client.post('/wallet/create')).json()['data']['data']
+            sender, private_key = wallet['publicKey'], wallet['privateKey']
+
+            for _ in range(2):
+                (await client.get('/mine')).raise_for_status()
+
+            #mining pays the reward to the last created wallet, so the recipient is made afterwards
+            recipient = (await client.post('/wallet/create')).json()['data']['data']['publicKey']
+
+            async with async_session_maker() as session:
+                funded = (await session.get(Wallet, sender)).balance
+
+            #twice the balance is asked for in total, so half of the requests must be refused
+            amount = funded * 2 / requests
+            transactions = []
+            for i in range(requests):
+                transaction = {"sender": sender, "recipient": recipient, "amount": amount, "fee": (i + 1) * 1e-9}
+                signature = blockchain.sign_transaction(private_key, signed_fields(transaction))
+                transactions.append({**transaction, "signature": signature})
+
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def submit(transaction: dict) -> bool:
+                async with semaphore:
+                    response = await client.post('/new_transaction', json=transaction)
+                    return response.status_code == 200
+
+            started = time.perf_counter()
+            accepted = await asyncio.gather(*(submit(t) for t in transactions))
+            elapsed = time.perf_counter() - started
+
+            spent = sum(t['amount'] + t['fee'] for t, ok in zip(transactions, accepted) if ok)
+
+            async with async_session_maker() as session:
+                reserved = (await session.get(Wallet, sender)).reserved
+
+            (await client.post('/wallet/create')).raise_for_status()
+            (await client.get('/mine')).raise_for_status()
+
+            async with async_session_maker() as session:
+                remaining = (await session.get(Wallet, sender)).balance
+
+    result = {
+        "scenario": "double-spend",
+        "requests": requests,
+        "concurrency": concurrency,
+        "accepted": sum(accepted),
+        "funded": funded,
+        "spent": spent,
+        "remaining": remaining,
+        "tx_per_sec": requests / elapsed,
+        "ok": spent <= funded + 1e-6 and abs(reserved - spent) < 1e-6 and abs(funded - spent - remaining) < 1e-6,
+    }
+    return result
+
+
+async def storage(args: argparse.Namespace) -> dict:
+    """
+    Measures the database paths on whichever backend BLOCKCHAIN_DATABASE_URL selects: transaction ingest
+    (one reservation UPDATE each), mining them into blocks, and concurrent /chain page reads
+    """
+    import httpx
+    from api import app, blockchain
+    from db import DATABASE_URL, engine
+    from signatures import signed_fields
+
+    requests, concurrency = args.requests, args.concurrency
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            wallet = (await client.post('/wallet/create')).json()['data']['data']
+            sender, private_key = wallet['publicKey'], wallet['privateKey']
+            (await client.get('/mine')).raise_for_status()
+            recipient = (await client.post('/wallet/create')).json()['data']['data']['publicKey']
+
+            amount = 0.5 / requests
+            transactions = []
+            for i in range(requests):
+                transaction = {"sender": sender, "recipient": recipient, "amount": amount, "fee": (i + 1) * 1e-12}
+                signature = blockchain.sign_transaction(private_key, signed_fields(transaction))
+                transactions.append({**transaction, "signature": signature})
+
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def timed(method: str, path: str, **kwargs) -> float:
+                async with semaphore:
+                    started = time.perf_counter()
+                    (await client.request(method, path, **kwargs)).raise_for_status()
+                    return time.perf_counter() - started
+
+            started = time.perf_counter()
+            ingest = await asyncio.gather(*(timed('POST', '/new_transaction', json=t) for t in transactions))
+            ingest_elapsed = time.perf_counter() - started
+
+            started = time.perf_counter()
+            blocks = 0
+            while len(blockchain.mempool):
+                (await client.get('/mine')).raise_for_status()
+                blocks += 1
+            mine_elapsed = time.perf_counter() - started
+
+            started = time.perf_counter()
+            reads = await asyncio.gather(*(
+                timed('GET', '/chain', params={"from_index": 1, "limit": 100}) for _ in range(requests)
+            ))
+            read_elapsed = time.perf_counter() - started
+
+    await engine.dispose()
+
+    return {
+        "scenario": "storage",
+        "backend": DATABASE_URL.split(':', 1)[0],
+        "requests": requests,
+        "concurrency": concurrency,
+        "ingest_tx_per_sec": requests / ingest_elapsed,
+        "ingest_p50_ms": percentile(ingest, 50) * 1000,
+        "ingest_p99_ms": percentile(ingest, 99) * 1000,
+        "blocks_mined": blocks,
+        "mine_sec": mine_elapsed,
+        "chain_reads_per_sec": requests / read_elapsed,
+        "chain_read_p50_ms": percentile(reads, 50) * 1000,
+        "chain_read_p99_ms": percentile(reads, 99) * 1000,
+        "ok": True,
+    }
+
+
+async def mining(args: argparse.Namespace) -> dict:
+    """
+    Measures proof of work: the hash rate of one core, of the miner's worker pool, and how long /mine
+    takes end to end. The pool's rate counts every proof its workers hashed, including the batches
+    searched past the answer.
+    """
+    import httpx
+    from api import app, blockchain
+    from difficulty import INITIAL_DIFFICULTY
+    from miner import search_range
+
+    #a zero target is never met, so the whole range is hashed
+    single_core_hashes = 200_000
+    started = time.perf_counter()
+    _, single_core_hashes = search_range(100, bytes(32), 0, single_core_hashes)
+    single_core_elapsed = time.perf_counter() - started
+
+    async with app.router.lifespan_context(app):
+        hashes = blockchain.miner.hashes
+        last_proof = 100
+        started = time.perf_counter()
+        for _ in range(args.blocks):
+            last_proof = await blockchain.proof_of_work(last_proof, INITIAL_DIFFICULTY)
+        pool_elapsed = time.perf_counter() - started
+        hashes = blockchain.miner.hashes - hashes
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            (await client.post('/wallet/create')).raise_for_status()
+
+            #the difficulty first retargets after RETARGET_INTERVAL blocks, keep --blocks at or under it to
+            #time every block at the same difficulty
+            mined = []
+            for _ in range(args.blocks):
+                started = time.perf_counter()
+                (await client.get('/mine')).raise_for_status()
+                mined.append(time.perf_counter() - started)
+
+    return {
+        "scenario": "mining",
+        "blocks": args.blocks,
+        "difficulty": INITIAL_DIFFICULTY,
+        "workers": blockchain.miner.workers,
+        "hashes_per_sec_single_core": single_core_hashes / single_core_elapsed,
+        "hashes_per_sec": hashes / pool_elapsed,
+        "mine_p50_ms": percentile(mined, 50) * 1000,
+        "mine_p99_ms": percentile(mined, 99) * 1000,
+        "ok": True,
+    }
+
+
+async def chain_reads(args: argparse.Namespace) -> dict:
+    """
+    Loads a chain of --height blocks with --density transactions each, then measures reading it back:
+    the whole chain through /chain, concurrent pages of it, and headers
+    """
+    import httpx
+    from api import app
+    from blockchain import CHAIN_PAGE_SIZE
+
+    chain = await seed_chain(args.height, args.density)
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            started = time.perf_counter()
+            await announce_chain(client, chain)
+            append_elapsed = time.perf_counter() - started
+
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def timed(path: str, **params) -> float:
+                async with semaphore:
+                    started = time.perf_counter()
+                    (await client.get(path, params=params)).raise_for_status()
+                    return time.perf_counter() - started
+
+            full = [await timed('/chain') for _ in range(FULL_CHAIN_READS)]
+            length = (await client.get('/chain/length')).json()['length']
+
+            page_size = min(CHAIN_PAGE_SIZE, args.height)
+            starts = [1 + (i * page_size) % max(1, args.height - page_size + 1) for i in range(args.requests)]
+
+            started = time.perf_counter()
+            pages = await asyncio.gather(*(timed('/chain', from_index=s, limit=page_size) for s in starts))
+            pages_elapsed = time.perf_counter() - started
+
+            headers = await asyncio.gather(*(timed('/chain/headers', **{"from": s}) for s in starts))
+
+    return {
+        "scenario": "chain-reads",
+        "height": args.height,
+        "density": args.density,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "append_blocks_per_sec": args.height / append_elapsed,
+        "full_chain_p50_ms": percentile(full, 50) * 1000,
+        "full_chain_p99_ms": percentile(full, 99) * 1000,
+        "page_size": page_size,
+        "page_reads_per_sec": args.requests / pages_elapsed,
+        "page_p50_ms": percentile(pages, 50) * 1000,
+        "page_p99_ms": percentile(pages, 99) * 1000,
+        "headers_p50_ms": percentile(headers, 50) * 1000,
+        "headers_p99_ms": percentile(headers, 99) * 1000,
+        "ok": length == args.height,
+    }
+
+
+async def sync(args: argparse.Namespace) -> dict:
+    """
+    Starts --peers peer nodes holding the same chain at different heights, up to --height, and times
+    resolve_conflicts bringing an empty node up to the longest of them. It is then timed again, in sync,
+    which is the cost of probing the peers.
+    """
+    import httpx
+    from api import app, blockchain
+    from db import async_session_maker
+
+    chain = await seed_chain(args.height, args.density)
+
+    async with run_peers(args.peers) as peers:
+        async with httpx.AsyncClient(timeout=None) as client:
+            for i, peer in enumerate(peers):
+                client.base_url = peer
+                await announce_chain(client, chain[:max(1, args.height - i)])
+
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                (await client.post('/nodes/register', json={"nodes": peers})).raise_for_status()
+
+            async with async_session_maker() as session:
+                started = time.perf_counter()
+                replaced = await blockchain.resolve_conflicts(session)
+                sync_elapsed = time.perf_counter() - started
+
+                started = time.perf_counter()
+                await blockchain.resolve_conflicts(session)
+                in_sync_elapsed = time.perf_counter() - started
+
+                tip = await blockchain.last_block(session)
+
+    return {
+        "scenario": "sync",
+        "height": args.height,
+        "density": args.density,
+        "peers": args.peers,
+        "sync_sec": sync_elapsed,
+        "sync_blocks_per_sec": args.height / sync_elapsed,
+        "resolve_in_sync_ms": in_sync_elapsed * 1000,
+        "ok": replaced and tip is not None and tip.index == args.height,
+    }
+
+
+SCENARIOS = {
+    "double-spend": double_spend,
+    "storage": storage,
+    "mining": mining,
+    "chain-reads": chain_reads,
+    "sync": sync,
+}
+
+
+def compare_backends(args: argparse.Namespace) -> int:
+    """
+    Runs a scenario once per --database-url, each in its own process since db.py binds its engine on import
+    """
+    status = 0
+    for url in args.database_url:
+        command = [sys.executable, os.path.abspath(__file__), args.scenario,
+                   '--requests', str(args.requests), '--concurrency', str(args.concurrency),
+                   '--blocks', str(args.blocks), '--height', str(args.height), '--density', str(args.density),
+                   '--peers', str(args.peers)]
+        completed = subprocess.run(command, env={**os.environ, "BLOCKCHAIN_DATABASE_URL": url})
+        status = status or completed.returncode
+    return status
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('scenario', choices=sorted(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--blocks', type=int, default=10, help="Blocks mined in the mining scenario")
+    parser.add_argument('--height', type=int, default=200, help="Height of the seeded chain")
+    parser.add_argument('--density', type=int, default=10, help="Transactions in each seeded block")
+    parser.add_argument('--peers', type=int, default=3, help="Peer nodes started for the sync scenario")
+    parser.add_argument('--database-url', action='append', default=[],
+                        help="Run against this database instead of a scratch SQLite file, can be repeated")
+    args = parser.parse_args()
+
+    if args.database_url:
+        return compare_backends(args)
+
+    #db.py opens ./blockchain.db when imported, so the benchmark runs from a scratch directory
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(tempfile.mkdtemp(prefix="blockchain-bench-"))
+
+    result = asyncio.run(SCENARIOS[args.scenario](args))
+    result.update(peak_rss())
+    print(json.dumps(result))
+    return 0 if result['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
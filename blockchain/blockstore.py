@@ -0,0 +1,187 @@
+"""This python file contains the optional append-only block store: canonical block encodings in segment files, read through mmap"""
+import json
+import mmap
+import os
+import struct
+
+#Directory of the block store, the store is off unless this is set
+BLOCK_STORE_DIR = os.environ.get("BLOCKCHAIN_BLOCK_STORE")
+
+#A new segment file is started once the current one would grow past this many bytes
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+#Each record is a 4 byte big endian length followed by the block's canonical JSON encoding
+RECORD_HEADER = struct.Struct(">I")
+
+#The index has one entry per block, in block order: segment number, offset of the record, its length
+INDEX_ENTRY = struct.Struct(">IQI")
+
+
+def encode_block(block: dict) -> bytes:
+    """
+    Returns the canonical encoding of a block dict, as stored and as served to peers
+    """
+    return json.dumps(block, sort_keys=True, separators=(',', ':')).encode()
+
+
+class BlockStore(object):
+    """
+    Blocks 1..height appended to segment files, with an index of where each one starts. Reads slice the
+    segments through mmap, so serving a range of blocks never touches the DB or builds ORM objects. The
+    DB stays the source of truth: the store is brought back in line with it on start up.
+    """
+
+    def __init__(self, directory: str, segment_size: int = SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self._index = bytearray()
+        self._index_file = None
+        self._segment_file = None
+        self._segment_number = 0
+        self._segment_length = 0
+        #segment number -> mmap of it, remapped when a read goes past the mapped length
+        self._maps: dict[int, mmap.mmap] = {}
+        self._opened = False
+
+    @property
+    def height(self) -> int:
+        self._open()
+        return len(self._index) // INDEX_ENTRY.size
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"segment-{number:06d}.dat")
+
+    def _entry(self, index: int) -> tuple[int, int, int]:
+        return INDEX_ENTRY.unpack_from(self._index, (index - 1) * INDEX_ENTRY.size)
+
+    def _open(self) -> None:
+        if self._opened:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        index_path = os.path.join(self.directory, "index.dat")
+        self._index = bytearray()
+        if os.path.exists(index_path):
+            with open(index_path, 'rb') as f:
+                self._index = bytearray(f.read())
+
+        #a crash can leave a partial index entry, or entries for records which never reached the disk
+        self._index = self._index[:len(self._index) - len(self._index) % INDEX_ENTRY.size]
+        sizes: dict[int, int] = {}
+        valid = 0
+        while valid < len(self._index) // INDEX_ENTRY.size:
+            number, offset, length = self._entry(valid + 1)
+            if number not in sizes:
+                path = self._segment_path(number)
+                sizes[number] = os.path.getsize(path) if os.path.exists(path) else 0
+            if offset + RECORD_HEADER.size + length > sizes[number]:
+                break
+            valid += 1
+
+        self._opened = True
+        self._truncate_to(valid)
+
+    def _truncate_to(self, height: int) -> None:
+        """
+        Drops every block after `height`, along with any bytes in the segments past the last one kept
+        """
+        self._close_files()
+        del self._index[height * INDEX_ENTRY.size:]
+
+        if height:
+            number, offset, length = self._entry(height)
+            end = offset + RECORD_HEADER.size + length
+        else:
+            number, end = 0, 0
+
+        index_path = os.path.join(self.directory, "index.dat")
+        if not os.path.exists(index_path) or os.path.getsize(index_path) != len(self._index):
+            with open(index_path, 'wb') as f:
+                f.write(self._index)
+
+        later = number + 1
+        while os.path.exists(self._segment_path(later)):
+            os.remove(self._segment_path(later))
+            later += 1
+
+        with open(self._segment_path(number), 'ab') as f:
+            f.truncate(end)
+
+        self._index_file = open(index_path, 'ab')
+        self._segment_file = open(self._segment_path(number), 'ab')
+        self._segment_number = number
+        self._segment_length = end
+
+    def append(self, blocks: list[dict]) -> None:
+        """
+        Appends blocks, which must follow on from the current height
+        """
+        self._open()
+        for block in blocks:
+            if block['index'] != self.height + 1:
+                raise ValueError(f"Block {block['index']} does not follow block {self.height}")
+
+            record = encode_block(block)
+            if self._segment_length and self._segment_length + RECORD_HEADER.size + len(record) > self.segment_size:
+                self._segment_file.close()
+                self._segment_number += 1
+                self._segment_file = open(self._segment_path(self._segment_number), 'ab')
+                self._segment_length = 0
+
+            #the record goes down before its index entry, so the index never points past the data
+            self._segment_file.write(RECORD_HEADER.pack(len(record)) + record)
+            self._segment_file.flush()
+            entry = INDEX_ENTRY.pack(self._segment_number, self._segment_length, len(record))
+            self._index_file.write(entry)
+            self._index_file.flush()
+            self._index += entry
+            self._segment_length += RECORD_HEADER.size + len(record)
+
+    def truncate(self, from_index: int) -> None:
+        """
+        Drops blocks from_index onwards, eg. before a reorg appends the new ones
+        """
+        self._open()
+        if from_index <= self.height:
+            self._truncate_to(max(0, from_index - 1))
+
+    def read(self, from_index: int = 1, limit: int | None = None) -> list[bytes]:
+        """
+        Returns the encodings of the blocks from from_index onwards, copied straight out of the mapped segments
+        """
+        self._open()
+        stop = self.height if limit is None else min(self.height, from_index + limit - 1)
+
+        records = []
+        for index in range(max(1, from_index), stop + 1):
+            number, offset, length = self._entry(index)
+            start = offset + RECORD_HEADER.size
+            records.append(self._map(number, start + length)[start:start + length])
+        return records
+
+    def blocks(self, from_index: int = 1, limit: int | None = None) -> list[dict]:
+        return [json.loads(record) for record in self.read(from_index, limit)]
+
+    def _map(self, number: int, needed: int) -> mmap.mmap:
+        segment_map = self._maps.get(number)
+        if segment_map is None or len(segment_map) < needed:
+            if segment_map is not None:
+                segment_map.close()
+            with open(self._segment_path(number), 'rb') as f:
+                segment_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[number] = segment_map
+        return segment_map
+
+    def close(self) -> None:
+        self._close_files()
+        self._opened = False
+
+    def _close_files(self) -> None:
+        for segment_map in self._maps.values():
+            segment_map.close()
+        self._maps.clear()
+
+        for f in (self._index_file, self._segment_file):
+            if f is not None:
+                f.close()
+        self._index_file = self._segment_file = None
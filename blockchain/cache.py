@@ -0,0 +1,108 @@
+"""This python file contains the response cache for the read endpoints: pre-serialised bodies keyed by the chain state they were built from"""
+import hashlib
+import os
+from collections import OrderedDict
+from typing import NamedTuple
+
+import metrics
+
+#Total size of the cached bodies, the least recently used are dropped past it. 0 turns the cache off
+CACHE_MAX_BYTES = int(os.environ.get("BLOCKCHAIN_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+#Bodies bigger than this share of the budget are served but never cached, eg. a whole long chain
+CACHE_MAX_ENTRY_SHARE = 4
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+    media_type: str
+    headers: dict[str, str]
+
+
+class ResponseCache(object):
+    """
+    Response bodies keyed by what they were built from: the endpoint and its parameters, plus the state
+    they depend on, eg. the tip hash and the mempool version. A new block or transaction means a new key,
+    and invalidate() drops everything on top of that, so a stale body is never served.
+    The ETag is derived from the key, so a request can be answered 304 without building the body at all.
+    Keys must therefore hold everything their body depends on.
+    """
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        #bumped by invalidate(), so a body which was being built meanwhile isn't kept
+        self.generation = 0
+        self._entries: OrderedDict[tuple, CachedResponse] = OrderedDict()
+
+    @staticmethod
+    def etag(key: tuple) -> str:
+        """
+        The key pins down the body, eg. a chain up to a tip hash is always the same chain, so the ETag
+        survives invalidate() and a poller keeps getting 304 until what it asked for actually changes
+        """
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        return f'"{digest[:32]}"'
+
+    def get(self, key: tuple) -> CachedResponse | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            metrics.CACHE_REQUESTS.inc(1, "miss")
+            return None
+
+        self._entries.move_to_end(key)
+        metrics.CACHE_REQUESTS.inc(1, "hit")
+        return entry
+
+    def put(self, key: tuple, body: bytes, media_type: str = "application/json",
+            headers: dict[str, str] | None = None, generation: int | None = None) -> CachedResponse:
+        """
+        Stores a body, if it fits
+        :param generation: <int> The generation when the body was started. If the cache was invalidated while
+                           it was being built the body may mix old and new state, so it isn't kept
+        :return: <CachedResponse> The entry, which is returned even when it wasn't kept
+        """
+        entry = CachedResponse(body, self.etag(key), media_type, headers or {})
+        if generation is not None and generation != self.generation:
+            return entry
+        if len(body) * CACHE_MAX_ENTRY_SHARE > self.max_bytes:
+            return entry
+
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size_bytes -= len(old.body)
+
+        self._entries[key] = entry
+        self.size_bytes += len(body)
+        while self.size_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size_bytes -= len(evicted.body)
+        return entry
+
+    def invalidate(self) -> None:
+        """
+        Drops every cached body, called whenever the chain, the balances or the mempool change
+        """
+        self._entries.clear()
+        self.size_bytes = 0
+        self.generation += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Returns True if an If-None-Match header names the ETag, or is "*"
+    """
+    if not if_none_match:
+        return False
+
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate in (etag, '*'):
+            return True
+    return False
@@ -0,0 +1,64 @@
+"""This python file contains the difficulty rules: how a block's difficulty maps to a proof target and how it is retargeted"""
+import hashlib
+from datetime import datetime
+
+#A proof is valid when its SHA-256 digest, read as an integer, is at most MAX_TARGET // difficulty
+MAX_TARGET = 2 ** 256 - 1
+
+#2**16 keeps the original rule of 4 leading zero hex digits for the first blocks
+INITIAL_DIFFICULTY = 2 ** 16
+
+#The difficulty is adjusted every RETARGET_INTERVAL blocks, aiming for one block per TARGET_BLOCK_TIME seconds
+RETARGET_INTERVAL = 10
+TARGET_BLOCK_TIME = 30
+
+#A single retarget can move the difficulty by at most this factor in either direction
+MAX_ADJUSTMENT = 4
+
+
+def target(difficulty: int) -> int:
+    """
+    Returns the largest digest value accepted for a block of the given difficulty
+    """
+    return MAX_TARGET // difficulty
+
+
+def target_bytes(difficulty: int) -> bytes:
+    """
+    Returns the target as 32 big endian bytes, so raw digests can be compared to it directly
+    """
+    return target(difficulty).to_bytes(32, 'big')
+
+
+def is_retarget_height(height: int) -> bool:
+    """
+    Returns True if the block following block number `height` gets a new difficulty
+    """
+    return height >= RETARGET_INTERVAL and height % RETARGET_INTERVAL == 0
+
+
+def retarget(difficulty: int, window_start: datetime, window_end: datetime) -> int:
+    """
+    Scales the difficulty by how long the last RETARGET_INTERVAL blocks took compared to the goal
+    :param difficulty: <int> Difficulty of the last block in the window
+    :param window_start: <datetime> Timestamp of the first block in the window
+    :param window_end: <datetime> Timestamp of the last block in the window
+    :return: <int> Difficulty for the next block
+    """
+
+    expected = TARGET_BLOCK_TIME * (RETARGET_INTERVAL - 1)
+
+    #peers only see timestamps to the second, so sub-second precision must not affect the result
+    elapsed = window_end.replace(microsecond=0) - window_start.replace(microsecond=0)
+    actual = int(elapsed.total_seconds())
+    actual = min(max(actual, expected // MAX_ADJUSTMENT), expected * MAX_ADJUSTMENT)
+
+    return max(1, difficulty * expected // actual)
+
+
+def valid_proof(last_proof: int, proof: int, difficulty: int) -> bool:
+    """
+    Returns True if hash(last_proof, proof), read as an integer, is at most the target for the difficulty
+    """
+    guess_hash = hashlib.sha256(f'{last_proof}{proof}'.encode()).digest()
+    return guess_hash <= target_bytes(difficulty)
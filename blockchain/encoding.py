@@ -0,0 +1,81 @@
+"""This python file contains the canonical encodings of blocks and timestamps, shared by the node and its worker processes"""
+import hashlib
+import json
+from datetime import datetime, timezone
+import pytz
+
+from merkle import merkle_root
+
+sask_time = pytz.timezone("America/Regina")
+
+def time_format(dt: datetime | None) -> str | None:
+    if dt is None:
+        return None
+
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    local_dt = dt.astimezone(sask_time)
+    return local_dt.strftime("%Y-%m-%d %H:%M:%S")
+
+def parse_time(value: str | None) -> datetime | None:
+    """
+    Inverse of time_format, returns the naive UTC datetime stored in the DB
+    """
+    if value is None:
+        return None
+
+    local_dt = sask_time.localize(datetime.strptime(value, "%Y-%m-%d %H:%M:%S"))
+    return local_dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+def block_header(block: dict, root: str | None = None) -> bytes:
+    """
+    Returns the canonical encoding of a block header, which is what the block hash commits to.
+    The transactions are folded into their merkle root, so the header has a fixed shape
+    :param root: <str> The block's merkle root, if the caller has already computed it
+    """
+    header = {
+        "index": block['index'],
+        "timestamp": block['timestamp'],
+        "previous_hash": block['previous_hash'],
+        "proof": block['proof'],
+        "difficulty": block['difficulty'],
+        "merkle_root": root if root is not None else transactions_root(block),
+    }
+    return json.dumps(header, sort_keys=True, separators=(',', ':')).encode()
+
+def transactions_root(block: dict) -> str:
+    """
+    Returns the merkle root of a block's transaction ids
+    """
+    return merkle_root([transaction_id(t, block['index']) for t in block['transactions']])
+
+def canonical_transaction(transaction: dict, height: int | None = None) -> dict:
+    """
+    Returns the fields of a transaction that get hashed. Amounts are always floats, so 1 and 1.0 hash the same.
+    Coinbases carry no signature, so the height of their block is added to keep two equal rewards apart
+    :param height: <int> Index of the block the transaction is in, only used for coinbases
+    """
+    fields = {
+        "sender": transaction['sender'],
+        "recipient": transaction['recipient'],
+        "amount": float(transaction['amount']),
+        "fee": float(transaction.get('fee', 0.0)),
+        "signature": transaction.get('signature'),
+    }
+    if transaction['sender'] == "0":
+        fields['height'] = height
+    return fields
+
+def transaction_id(transaction: dict, height: int | None = None) -> str:
+    """
+    Returns the id of a transaction, the SHA-256 hash of its canonical encoding
+    :param height: <int> Index of the block the transaction is in, which a coinbase's id depends on
+    """
+    encoded = json.dumps(canonical_transaction(transaction, height), sort_keys=True, separators=(',', ':')).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+def key_fingerprint(public_key: str) -> str:
+    """
+    Returns a short, fixed size stand in for a public key, the SHA-256 hash of the key string
+    """
+    return hashlib.sha256(public_key.encode()).hexdigest()
@@ -0,0 +1,132 @@
+"""This python file contains wallet key generation, and a pool of keypairs generated ahead of time in worker processes"""
+import asyncio
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa, ed25519
+
+#Kinds of wallet key, RSA-2048 as before or Ed25519, which is far faster to generate, sign and verify with
+KEY_TYPES = ("rsa", "ed25519")
+WALLET_KEY_TYPE = os.environ.get("BLOCKCHAIN_WALLET_KEY_TYPE", "rsa")
+
+#Keypairs of each kind kept ready, the pool is topped back up to this in the background
+KEY_POOL_SIZE = int(os.environ.get("BLOCKCHAIN_KEY_POOL_SIZE", "32"))
+
+
+def _pem_body(pem: bytes) -> str:
+    """
+    Strips the header lines and line breaks from a PEM block, leaving the base64 body wallets are shown as
+    """
+    return "".join(line for line in pem.decode().splitlines() if not line.startswith("-----"))
+
+
+def generate_keypair(key_type: str = "rsa") -> tuple[str, str]:
+    """
+    Generates a wallet keypair
+    :param key_type: <str> One of KEY_TYPES
+    :return: <tuple> The public key (SubjectPublicKeyInfo) and the private key, as bare base64 bodies
+    """
+    if key_type == "rsa":
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        private_format = serialization.PrivateFormat.TraditionalOpenSSL
+    elif key_type == "ed25519":
+        private_key = ed25519.Ed25519PrivateKey.generate()
+        private_format = serialization.PrivateFormat.PKCS8
+    else:
+        raise ValueError(f"Unknown key type {key_type}")
+
+    public_pem = private_key.public_key().public_bytes(encoding=serialization.Encoding.PEM,
+                    format=serialization.PublicFormat.SubjectPublicKeyInfo)
+    private_pem = private_key.private_bytes(encoding=serialization.Encoding.PEM, format=private_format,
+                    encryption_algorithm=serialization.NoEncryption())
+
+    return _pem_body(public_pem), _pem_body(private_pem)
+
+
+def generate_keypairs(key_type: str, count: int) -> list[tuple[str, str]]:
+    """
+    Generates several keypairs, this is what a worker process runs
+    """
+    return [generate_keypair(key_type) for _ in range(count)]
+
+
+class KeyPool(object):
+    """
+    Keypairs generated ahead of time in worker processes, so creating a wallet doesn't block the event loop
+    on key generation. Taking a keypair starts a refill once the pool is below its size.
+    """
+
+    def __init__(self, size: int = KEY_POOL_SIZE, workers: int | None = None):
+        self.size = size
+        self.workers = workers or os.cpu_count() or 1
+        self._executor: ProcessPoolExecutor | None = None
+        self._keys: dict[str, deque[tuple[str, str]]] = {key_type: deque() for key_type in KEY_TYPES}
+        self._refills: dict[str, asyncio.Task] = {}
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def shutdown(self) -> None:
+        for task in self._refills.values():
+            task.cancel()
+        self._refills.clear()
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def available(self, key_type: str) -> int:
+        return len(self._keys[key_type])
+
+    def start(self, key_type: str = WALLET_KEY_TYPE) -> None:
+        """
+        Fills the pool for a kind of key in the background, eg. on start up
+        """
+        self._refill(key_type)
+
+    async def take(self, key_type: str = WALLET_KEY_TYPE) -> tuple[str, str]:
+        """
+        Returns a fresh keypair, from the pool if it has one, else generated in a worker straight away
+        :return: <tuple> The public and private key, as bare base64 bodies
+        """
+        if key_type not in KEY_TYPES:
+            raise ValueError(f"Unknown key type {key_type}")
+
+        keys = self._keys[key_type]
+        if keys:
+            keypair = keys.popleft()
+        else:
+            loop = asyncio.get_running_loop()
+            keypair = (await loop.run_in_executor(self.executor, generate_keypairs, key_type, 1))[0]
+
+        self._refill(key_type)
+        return keypair
+
+    def _refill(self, key_type: str) -> None:
+        if key_type in self._refills or len(self._keys[key_type]) >= self.size:
+            return
+
+        task = asyncio.get_running_loop().create_task(self._fill(key_type))
+        self._refills[key_type] = task
+        task.add_done_callback(lambda _: self._refills.pop(key_type, None))
+
+    async def _fill(self, key_type: str) -> None:
+        loop = asyncio.get_running_loop()
+        keys = self._keys[key_type]
+
+        while len(keys) < self.size:
+            #the missing keys are split across the workers, one task each
+            missing = self.size - len(keys)
+            per_worker = -(-missing // self.workers)
+            counts = [min(per_worker, missing - start) for start in range(0, missing, per_worker)]
+
+            batches = await asyncio.gather(*(
+                loop.run_in_executor(self.executor, generate_keypairs, key_type, count) for count in counts
+            ))
+            for batch in batches:
+                keys.extend(batch)
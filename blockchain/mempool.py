@@ -0,0 +1,141 @@
+"""This python file contains the mempool, the in memory set of transactions waiting to be mined"""
+import heapq
+import json
+from itertools import count
+
+from encoding import transaction_id
+
+#Limits on what the mempool holds, the lowest priority transactions are evicted past them
+MAX_MEMPOOL_COUNT = 50_000
+MAX_MEMPOOL_BYTES = 64 * 1024 * 1024
+
+
+class Mempool(object):
+    """
+    Pending transactions indexed by id, for dedup. Block assembly takes the highest fee
+    transactions first, earliest arrival breaking ties, and eviction drops the lowest fee, oldest ones.
+    Both orders are kept as heaps with lazy deletion, so neither needs a scan of the whole pool.
+    """
+
+    def __init__(self, max_count: int = MAX_MEMPOOL_COUNT, max_bytes: int = MAX_MEMPOOL_BYTES):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        #bumped on every change, so readers can tell whether the pool moved
+        self.version = 0
+        self._entries: dict[str, dict] = {}
+        self._best: list[tuple[float, int, str]] = []
+        self._worst: list[tuple[float, int, str]] = []
+        self._arrivals = count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, tx_id: str) -> bool:
+        return tx_id in self._entries
+
+    def add(self, transaction: dict) -> tuple[str, list[dict]]:
+        """
+        Adds a transaction, evicting lower priority ones if the pool is over budget
+        :param transaction: <dict> with a sender, recipient, amount, fee and signature
+        :return: <tuple> The transaction id, and the transactions evicted to make room
+        """
+        tx_id = transaction_id(transaction)
+        if tx_id in self._entries:
+            raise ValueError("Transaction is already pending")
+
+        size = len(json.dumps(transaction))
+        fee = transaction.get('fee', 0.0)
+        arrival = next(self._arrivals)
+
+        if size > self.max_bytes:
+            raise ValueError("Transaction is too large")
+
+        #a full pool only takes a transaction paying at least as much as its worst one, which it replaces
+        if self._over_budget(1, size):
+            worst = self._peek_worst()
+            if worst is None or fee < worst['fee']:
+                raise ValueError("Mempool is full")
+
+        self._entries[tx_id] = {
+            "id": tx_id,
+            "transaction": transaction,
+            "fee": fee,
+            "arrival": arrival,
+            "size": size,
+        }
+        heapq.heappush(self._best, (-fee, arrival, tx_id))
+        heapq.heappush(self._worst, (fee, arrival, tx_id))
+        self.size_bytes += size
+        self.version += 1
+
+        evicted = []
+        while self._over_budget(0, 0):
+            worst = self._peek_worst()
+            evicted.append(worst['transaction'])
+            self._discard(worst['id'])
+
+        return tx_id, evicted
+
+    def select(self, limit: int) -> list[dict]:
+        """
+        Returns up to `limit` transactions for the next block, highest fee first. They stay in the pool
+        until remove() is called once the block is committed
+        """
+        chosen: list[tuple[float, int, str]] = []
+        while self._best and len(chosen) < limit:
+            item = heapq.heappop(self._best)
+            if self._live(item):
+                chosen.append(item)
+
+        for item in chosen:
+            heapq.heappush(self._best, item)
+
+        return [self._entries[tx_id]['transaction'] for _, _, tx_id in chosen]
+
+    def remove(self, tx_ids) -> list[dict]:
+        """
+        Drops transactions, eg. once they have been mined
+        :return: <list> The transactions which were in the pool
+        """
+        removed = []
+        for tx_id in tx_ids:
+            entry = self._entries.get(tx_id)
+            if entry is not None:
+                removed.append(entry['transaction'])
+                self._discard(tx_id)
+        return removed
+
+    def _live(self, item: tuple[float, int, str]) -> bool:
+        """
+        A heap item is live only if its transaction is still pending from that same arrival. An id which
+        was removed and added again has a new arrival, so its old items stay dead
+        """
+        entry = self._entries.get(item[2])
+        return entry is not None and entry['arrival'] == item[1]
+
+    def _over_budget(self, extra_count: int, extra_bytes: int) -> bool:
+        return (len(self._entries) + extra_count > self.max_count
+                or self.size_bytes + extra_bytes > self.max_bytes)
+
+    def _peek_worst(self) -> dict | None:
+        while self._worst and not self._live(self._worst[0]):
+            heapq.heappop(self._worst)
+        if not self._worst:
+            return None
+        return self._entries[self._worst[0][2]]
+
+    def _discard(self, tx_id: str) -> None:
+        entry = self._entries.pop(tx_id, None)
+        if entry is None:
+            return
+
+        self.size_bytes -= entry['size']
+        self.version += 1
+
+        #the heaps skip ids that are gone, rebuild them once they are mostly garbage
+        if len(self._best) > 2 * len(self._entries) + 1024:
+            self._best = [item for item in self._best if self._live(item)]
+            self._worst = [item for item in self._worst if self._live(item)]
+            heapq.heapify(self._best)
+            heapq.heapify(self._worst)
@@ -0,0 +1,64 @@
+"""This python file contains the merkle tree over a block's transaction ids, and inclusion proofs against its root"""
+import hashlib
+
+#Root of a block with no transactions
+EMPTY_ROOT = hashlib.sha256(b"").hexdigest()
+
+
+def _parent(left: str, right: str) -> str:
+    return hashlib.sha256(bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def _next_level(level: list[str]) -> list[str]:
+    #an odd node out is paired with itself
+    if len(level) % 2:
+        level = level + [level[-1]]
+    return [_parent(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+
+
+def merkle_root(tx_ids: list[str]) -> str:
+    """
+    Returns the root of the merkle tree whose leaves are the transaction ids, in block order
+    :param tx_ids: <list> Hex SHA-256 transaction ids
+    :return: <str> Hex root hash
+    """
+    if not tx_ids:
+        return EMPTY_ROOT
+
+    level = list(tx_ids)
+    while len(level) > 1:
+        level = _next_level(level)
+    return level[0]
+
+
+def merkle_proof(tx_ids: list[str], position: int) -> list[dict]:
+    """
+    Returns the sibling hashes linking the leaf at `position` to the root, from the bottom up
+    :return: <list> of {"hash": <str>, "side": "left" or "right"}, side being where the sibling goes
+    """
+    proof = []
+    level = list(tx_ids)
+    while len(level) > 1:
+        sibling = position ^ 1
+        if sibling >= len(level):
+            sibling = position
+        proof.append({"hash": level[sibling], "side": "left" if sibling < position else "right"})
+        level = _next_level(level)
+        position //= 2
+    return proof
+
+
+def verify_proof(tx_id: str, proof: list[dict], root: str) -> bool:
+    """
+    Returns True if the proof links tx_id to root
+    """
+    try:
+        current = tx_id
+        for step in proof:
+            if step['side'] == "left":
+                current = _parent(step['hash'], current)
+            else:
+                current = _parent(current, step['hash'])
+    except (KeyError, TypeError, ValueError):
+        return False
+    return current == root
@@ -0,0 +1,276 @@
+"""This python file contains the node's metrics: counters, gauges and histograms rendered in the Prometheus text format"""
+import functools
+import math
+import os
+import time
+from contextlib import nullcontext
+
+#Metrics are collected unless this is set to 0, when disabled every update returns straight away
+METRICS_ENABLED = os.environ.get("BLOCKCHAIN_METRICS", "1") != "0"
+
+#Time every API request into a histogram and a Server-Timing header, off by default
+TRACE_REQUESTS = os.environ.get("BLOCKCHAIN_TRACE_REQUESTS", "0") == "1"
+
+#Upper bounds of the histogram buckets in seconds, the Prometheus client defaults
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+#Media type of the text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+#Shared by every disabled timer, so timing something costs one attribute lookup when metrics are off
+_NULL_TIMER = nullcontext()
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Timer(object):
+    """
+    Observes how long the block it wraps took, in seconds
+    """
+
+    __slots__ = ("_histogram", "_labels", "_start")
+
+    def __init__(self, histogram, labels: tuple[str, ...]):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._start, *self._labels)
+        return False
+
+
+class Metric(object):
+    """
+    A named metric with optional labels. Each distinct set of label values gets its own series. Updates
+    all happen on the event loop thread, so they need no lock.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, *labels: str) -> None:
+        if not METRICS_ENABLED:
+            return
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+                for labels, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """
+    A value which goes up and down. Given a function, the gauge is read from it at every scrape instead
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, function=None):
+        super().__init__(name, documentation)
+        self.function = function
+        self._value = 0.0
+
+    def set(self, value: float) -> None:
+        if not METRICS_ENABLED:
+            return
+        self._value = value
+
+    def samples(self) -> list[str]:
+        value = self.function() if self.function is not None else self._value
+        return [f"{self.name} {_format_value(value)}"]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        #label values -> [count in each bucket (not cumulative), sum, count]
+        self._series: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        if not METRICS_ENABLED:
+            return
+
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def time(self, *labels: str):
+        """
+        Returns a context manager which observes how long its block takes
+        """
+        if not METRICS_ENABLED:
+            return _NULL_TIMER
+        return _Timer(self, labels)
+
+    def samples(self) -> list[str]:
+        lines = []
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                le = _format_labels(self.labels, labels, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {count}")
+        return lines
+
+
+class Registry(object):
+    """
+    Every metric the node exposes, in the order they were registered
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        #registering a name again replaces the old metric, eg. a gauge bound to a new BlockChain
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry = Registry()
+
+
+def counter(name: str, documentation: str, labels: tuple[str, ...] = ()) -> Counter:
+    return registry.register(Counter(name, documentation, labels))
+
+
+def gauge(name: str, documentation: str, function=None) -> Gauge:
+    return registry.register(Gauge(name, documentation, function))
+
+
+def histogram(name: str, documentation: str, labels: tuple[str, ...] = (),
+              buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    return registry.register(Histogram(name, documentation, labels, buckets))
+
+
+def timed(metric: Histogram):
+    """
+    Decorates a coroutine function so every call is observed by the histogram
+    """
+    def decorator(function):
+        if not METRICS_ENABLED:
+            return function
+
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            with metric.time():
+                return await function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_engine(sync_engine) -> None:
+    """
+    Times every statement the engine runs, by its kind: SELECT, INSERT, UPDATE, DELETE or OTHER
+    :param sync_engine: The sync Engine behind an AsyncEngine, events are only raised on it
+    """
+    if not METRICS_ENABLED:
+        return
+
+    from sqlalchemy import event
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        kind = statement.lstrip()[:6].upper()
+        DB_QUERY_SECONDS.observe(elapsed, kind if kind in ("SELECT", "INSERT", "UPDATE", "DELETE") else "OTHER")
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        #the after event never fires for a failed statement, so its start time is dropped here
+        starts = context.connection.info.get('query_start') if context.connection is not None else None
+        if starts:
+            starts.pop()
+        DB_ERRORS.inc()
+
+
+#The node's metrics, updated where the work happens
+
+MINING_ATTEMPTS = counter("blockchain_mining_attempts_total",
+                          "Proof of work searches, by whether a proof was found, the search was cancelled or it failed",
+                          ("outcome",))
+HASHES = counter("blockchain_hashes_total",
+                 "Proofs hashed by the miner, including cancelled searches, the hash rate is its rate()")
+PROOF_OF_WORK_SECONDS = histogram("blockchain_proof_of_work_seconds", "Time spent searching for a proof",
+                                  buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0))
+NEW_BLOCK_SECONDS = histogram("blockchain_new_block_seconds", "Time to write a mined block to the chain")
+BLOCKS_MINED = counter("blockchain_blocks_mined_total", "Blocks mined by this node")
+SIGNATURE_VERIFY_SECONDS = histogram("blockchain_signature_verify_seconds",
+                                     "Time to verify a transaction signature, or a batch of them",
+                                     ("mode",))
+SIGNATURE_FAILURES = counter("blockchain_signature_failures_total", "Transactions with an invalid signature")
+GET_CHAIN_SECONDS = histogram("blockchain_get_chain_seconds", "Time to read the chain, or a page of it")
+RESOLVE_CONFLICTS_SECONDS = histogram("blockchain_resolve_conflicts_seconds",
+                                      "Time to probe the peers and sync with the longest chain",
+                                      buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+CHAIN_REPLACEMENTS = counter("blockchain_chain_replacements_total", "Times our chain was replaced by a peer's")
+PEER_FAILURES = counter("blockchain_peer_failures_total",
+                        "Requests to peers which failed, timed out or were answered with garbage",
+                        ("operation",))
+DB_QUERY_SECONDS = histogram("blockchain_db_query_seconds", "Time to run a database statement", ("statement",))
+DB_ERRORS = counter("blockchain_db_errors_total", "Database statements which raised an error")
+HTTP_REQUEST_SECONDS = histogram("blockchain_http_request_seconds",
+                                 "Time to handle an API request, only collected while requests are traced",
+                                 ("method", "route", "status"))
+CACHE_REQUESTS = counter("blockchain_response_cache_requests_total", "Read response cache lookups, by hit or miss",
+                         ("result",))
@@ -0,0 +1,120 @@
+"""This python file contains the proof of work mining engine, which searches the nonce space across a process pool"""
+import asyncio
+import hashlib
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+
+from difficulty import target_bytes
+import metrics
+
+# Number of proofs a worker checks per task. It also bounds how long a cancel takes to be noticed.
+BATCH_SIZE = 50_000
+
+
+def search_range(last_proof: int, target: bytes, start: int, stop: int) -> tuple[int | None, int]:
+    """
+    Searches [start, stop) for a proof p such that hash(last_proof, p) is at most the target
+    :param last_proof: <int> Previous proof
+    :param target: <bytes> 32 byte big endian target
+    :param start: <int> First proof to try
+    :param stop: <int> Proof to stop before
+    :return: <tuple> The smallest valid proof in the range or None, and how many proofs were hashed
+    """
+
+    #the last_proof bytes are the same for every guess, so they are hashed once and the state copied
+    prefix = hashlib.sha256(str(last_proof).encode())
+
+    for proof in range(start, stop):
+        guess = prefix.copy()
+        guess.update(str(proof).encode())
+        if guess.digest() <= target:
+            return proof, proof - start + 1
+
+    return None, stop - start
+
+
+class Miner(object):
+    """
+    Runs the proof of work search in worker processes, so the event loop stays free while mining
+    """
+
+    def __init__(self, workers: int | None = None, batch_size: int = BATCH_SIZE):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self._executor: ProcessPoolExecutor | None = None
+        self._generation = 0
+        #proofs hashed by every search so far, including batches past the answer and cancelled searches
+        self.hashes = 0
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def cancel(self) -> None:
+        """
+        Abandons every search in progress, eg. when a competing block has replaced our tip
+        """
+        self._generation += 1
+
+    def _batch_done(self, loop: asyncio.AbstractEventLoop, future: Future) -> None:
+        #runs in the pool's thread, the count is handed over to the event loop's
+        try:
+            loop.call_soon_threadsafe(self._count_hashes, future)
+        except RuntimeError:
+            #the loop has already closed
+            pass
+
+    def _count_hashes(self, future: Future) -> None:
+        if future.cancelled() or future.exception() is not None:
+            return
+        tried = future.result()[1]
+        self.hashes += tried
+        metrics.HASHES.inc(tried)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def proof_of_work(self, last_proof: int, difficulty: int) -> int | None:
+        """
+        Finds the smallest proof p such that hash(last_proof, p) meets the target for `difficulty`.
+        The nonce space is split into consecutive ranges, and a window of them is kept in flight across
+        the pool. Ranges are consumed in order, so the answer matches a serial search.
+        :param last_proof: <int> Previous proof
+        :param difficulty: <int> Difficulty of the block being mined
+        :return: <int> The proof, or None if the search was cancelled
+        """
+
+        loop = asyncio.get_running_loop()
+        target = target_bytes(difficulty)
+        generation = self._generation
+        pending: deque[Future] = deque()
+        next_start = 0
+
+        def submit() -> None:
+            nonlocal next_start
+            future = self.executor.submit(search_range, last_proof, target, next_start, next_start + self.batch_size)
+            #a batch already running when the search ends can't be cancelled, it is counted once it finishes
+            future.add_done_callback(partial(self._batch_done, loop))
+            pending.append(future)
+            next_start += self.batch_size
+
+        for _ in range(self.workers * 2):
+            submit()
+
+        try:
+            while True:
+                proof, _ = await asyncio.wrap_future(pending.popleft())
+                if generation != self._generation:
+                    return None
+                if proof is not None:
+                    return proof
+                submit()
+        finally:
+            for future in pending:
+                future.cancel()
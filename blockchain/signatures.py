@@ -0,0 +1,153 @@
+"""This python file contains transaction signing and verification, with a cache of parsed keys and a process pool for batches"""
+import asyncio
+import base64
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from cryptography.hazmat.primitives import serialization, hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+
+import metrics
+
+#Parsed public keys kept per process, most wallets sign many transactions
+PUBLIC_KEY_CACHE_SIZE = 4096
+
+#Parsed private keys, only the few wallets this process signs for
+PRIVATE_KEY_CACHE_SIZE = 64
+
+
+@lru_cache(maxsize=PUBLIC_KEY_CACHE_SIZE)
+def load_public_key(public_key: str):
+    """
+    Parses a PEM public key, or the bare base64 body of one as handed out by /wallet/create
+    """
+    if not public_key.startswith("-----BEGIN"):
+        public_key = f"-----BEGIN PUBLIC KEY-----\n{public_key}\n-----END PUBLIC KEY-----\n"
+
+    return serialization.load_pem_public_key(public_key.encode())
+
+
+@lru_cache(maxsize=PRIVATE_KEY_CACHE_SIZE)
+def load_private_key(private_key: str):
+    """
+    Parses a PEM private key, or the bare base64 body of one as handed out by /wallet/create. The body is
+    DER, PKCS1 for RSA wallets and PKCS8 for Ed25519 ones, so it is loaded without guessing its header
+    """
+    if private_key.startswith("-----BEGIN"):
+        return serialization.load_pem_private_key(private_key.encode(), password=None)
+
+    return serialization.load_der_private_key(base64.b64decode(private_key), password=None)
+
+
+def _canonical_number(value):
+    #amounts are stored and sent as floats, so an int is signed as the float it will come back as.
+    #Anything which isn't a number is left alone, for the caller to reject
+    if isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def signed_fields(transaction: dict) -> dict:
+    """
+    Returns the part of a transaction covered by its signature. The fee is only included when one is paid,
+    so transactions signed before fees existed still verify. Numbers are signed as floats, so a transfer of
+    1 verifies the same once the DB, the wire format or a snapshot hands it back as 1.0
+    """
+    fields = {
+        'sender': transaction['sender'],
+        'recipient': transaction['recipient'],
+        'amount': _canonical_number(transaction['amount']),
+    }
+    if transaction.get('fee'):
+        fields['fee'] = _canonical_number(transaction['fee'])
+    return fields
+
+
+def sign(private_key: str, transaction: dict) -> str:
+    """
+    This function is used to sign a transaction, with Ed25519 or RSA PKCS1v15 over SHA-256 depending on the key
+    :param private_key: PEM encoded private key, or its bare base64 body
+    :param transaction: dict with a sender, recipent and the amount
+    :return: hex encoded signature
+    """
+    key = load_private_key(private_key)
+    message = json.dumps(transaction, sort_keys=True).encode()
+
+    if isinstance(key, Ed25519PrivateKey):
+        return key.sign(message).hex()
+    return key.sign(message, padding.PKCS1v15(), hashes.SHA256()).hex()
+
+
+def verify(public_key: str, transaction: dict, signature: str) -> bool:
+    """
+    This function is used to verify a transaction
+    :param public_key: PEM encoded public key
+    :param transaction: dict with a sender, recipent and the amount
+    :param signature: hex encoded signature
+    :return: true if the transaction is valid, false otherwise
+    """
+
+    try:
+        key = load_public_key(public_key)
+        message = json.dumps(transaction, sort_keys=True).encode()
+
+        if isinstance(key, Ed25519PublicKey):
+            key.verify(bytes.fromhex(signature), message)
+        else:
+            key.verify(bytes.fromhex(signature), message, padding.PKCS1v15(), hashes.SHA256())
+        return True
+
+    except Exception:
+        return False
+
+
+def verify_many(items: list[tuple[str, dict, str]]) -> list[bool]:
+    """
+    Verifies a list of (public_key, transaction, signature), this is what a worker process runs
+    """
+    return [verify(public_key, transaction, signature) for public_key, transaction, signature in items]
+
+
+class SignatureVerifier(object):
+    """
+    Fans batches of signature checks out to worker processes, so ingest scales with cores
+    """
+
+    def __init__(self, workers: int | None = None):
+        self.workers = workers or os.cpu_count() or 1
+        self._executor: ProcessPoolExecutor | None = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def verify_batch(self, items: list[tuple[str, dict, str]]) -> list[bool]:
+        """
+        Verifies many (public_key, transaction, signature) at once, one chunk per worker
+        :return: <list> True or False for each item, in order
+        """
+        if not items:
+            return []
+
+        loop = asyncio.get_running_loop()
+        chunk_size = -(-len(items) // self.workers)
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+        with metrics.SIGNATURE_VERIFY_SECONDS.time("batch"):
+            results = await asyncio.gather(*(
+                loop.run_in_executor(self.executor, verify_many, chunk) for chunk in chunks
+            ))
+
+        verified = [valid for chunk in results for valid in chunk]
+        metrics.SIGNATURE_FAILURES.inc(verified.count(False))
+        return verified
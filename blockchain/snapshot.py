@@ -0,0 +1,322 @@
+"""
+Chain snapshots, for bootstrapping a node without replaying a peer's whole chain through resolve_conflicts.
+A snapshot is gzipped JSON lines: a header, every block up to its height, every wallet's balance at that
+height, and a trailer holding the SHA-256 of everything before it.
+
+Usage: python snapshot.py export FILE [--height N]
+       python snapshot.py import FILE_OR_URL [--peer URL ...]
+
+Import into a node which is stopped and has no blocks yet. Blocks after the snapshot's height are then
+synced from the --peer nodes, if any are given, or by the node's own sync once it is running.
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import zlib
+from collections import defaultdict
+from collections.abc import AsyncIterator
+
+from sqlalchemy import select, func, insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import Block, Transaction, Wallet
+from encoding import parse_time, transaction_id, key_fingerprint
+import state
+from validation import check_balances
+
+#Written in the header, and checked before anything is imported
+SNAPSHOT_FORMAT = "blockchain-snapshot"
+SNAPSHOT_VERSION = 1
+
+#Rows sent to the DB per bulk INSERT, bounding the size of each statement
+INSERT_CHUNK_SIZE = 5000
+
+#Media type the /snapshot endpoint serves
+SNAPSHOT_MEDIA_TYPE = "application/gzip"
+
+
+def _line(record: dict) -> bytes:
+    return json.dumps(record, separators=(',', ':')).encode() + b"\n"
+
+
+def balance_deltas(blocks: list[dict]) -> dict[str, float]:
+    """
+    Returns every wallet's balance after the blocks, which start from the genesis block
+    """
+    balances: dict[str, float] = defaultdict(float)
+    for block in blocks:
+        for t in block['transactions']:
+            balances[t['recipient']] += t['amount']
+            if t['sender'] != "0":
+                balances[t['sender']] -= t['amount'] + t.get('fee', 0.0)
+    return balances
+
+
+async def export_lines(blockchain, session: AsyncSession, height: int | None = None) -> AsyncIterator[bytes]:
+    """
+    Yields the uncompressed lines of a snapshot at `height`, the tip if None. Everything is read in the
+    session's one transaction, so blocks mined meanwhile don't leak in
+    :raises ValueError: if the chain doesn't reach `height`
+    """
+    tip_height = (await session.execute(select(func.max(Block.id)))).scalar_one_or_none() or 0
+    height = tip_height if height is None else height
+    if not 0 < height <= tip_height:
+        raise ValueError(f"The chain has {tip_height} blocks, a snapshot needs from 1 to {tip_height}")
+
+    checksum = hashlib.sha256()
+    tip_hash = await blockchain.block_hash(session, height)
+
+    def record(data: dict) -> bytes:
+        line = _line(data)
+        checksum.update(line)
+        return line
+
+    yield record({"format": SNAPSHOT_FORMAT, "version": SNAPSHOT_VERSION, "height": height, "tip_hash": tip_hash})
+
+    #the balances are summed from the exported blocks, so they are the ones at `height` even below the tip
+    balances: dict[str, float] = defaultdict(float)
+    async for block in blockchain.iter_chain(session, 1, height):
+        for key, delta in balance_deltas([block]).items():
+            balances[key] += delta
+        yield record({"block": block})
+
+    #wallets nobody has paid yet are kept too, with nothing in them
+    for public_key in (await session.execute(select(Wallet.public_key))).scalars():
+        balances.setdefault(public_key, 0.0)
+    for public_key, balance in balances.items():
+        yield record({"wallet": [public_key, balance]})
+
+    yield _line({"sha256": checksum.hexdigest(), "blocks": height, "wallets": len(balances)})
+
+
+async def export_snapshot(blockchain, session: AsyncSession, height: int | None = None) -> AsyncIterator[bytes]:
+    """
+    Yields a gzipped snapshot, compressed as it is read out
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for line in export_lines(blockchain, session, height):
+        chunk = compressor.compress(line)
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+def read_snapshot(path: str) -> tuple[dict, list[dict], dict[str, float]]:
+    """
+    Reads a snapshot file and checks it is whole
+    :return: <tuple> The header, the blocks, and each wallet's balance
+    :raises ValueError: if the file isn't a snapshot, or doesn't match its checksum
+    """
+    checksum = hashlib.sha256()
+    header, trailer = None, None
+    blocks: list[dict] = []
+    wallets: dict[str, float] = {}
+
+    try:
+        with gzip.open(path, 'rb') as f:
+            for line in f:
+                if trailer is not None:
+                    raise ValueError("Data after the snapshot's checksum")
+
+                data = json.loads(line)
+                if 'sha256' in data:
+                    trailer = data
+                    continue
+
+                checksum.update(line)
+                if header is None:
+                    header = data
+                    if header.get('format') != SNAPSHOT_FORMAT or header.get('version') != SNAPSHOT_VERSION:
+                        raise ValueError("Not a snapshot this node can read")
+                elif 'block' in data:
+                    blocks.append(data['block'])
+                elif 'wallet' in data:
+                    public_key, balance = data['wallet']
+                    wallets[public_key] = balance
+                else:
+                    raise ValueError("Unknown record in the snapshot")
+    except (OSError, EOFError, json.JSONDecodeError, TypeError) as e:
+        raise ValueError(f"The snapshot is unreadable: {e}")
+
+    if header is None or trailer is None:
+        raise ValueError("The snapshot is truncated")
+    if trailer['sha256'] != checksum.hexdigest():
+        raise ValueError("The snapshot doesn't match its checksum")
+    if trailer.get('blocks') != len(blocks) or trailer.get('wallets') != len(wallets) \
+            or len(blocks) != header.get('height'):
+        raise ValueError("The snapshot is missing records")
+
+    return header, blocks, wallets
+
+
+async def import_snapshot(blockchain, session: AsyncSession, path: str) -> int:
+    """
+    Loads a snapshot into an empty chain. The blocks and their transactions are validated, replayed to check
+    no wallet is overdrawn, and the balances checked against them, then blocks, transactions and wallets go in
+    with bulk INSERTs in a single DB transaction
+    :return: <int> The snapshot's height
+    :raises ValueError: if the chain isn't empty, or the snapshot is damaged or invalid
+    """
+    header, blocks, wallets = read_snapshot(path)
+
+    if (await session.execute(select(func.max(Block.id)))).scalar_one_or_none():
+        raise ValueError("The chain isn't empty, a snapshot can only bootstrap a new node")
+
+    if blocks[-1].get('hash') != header.get('tip_hash') or not await blockchain.valid_chain(blocks):
+        raise ValueError("The snapshot's chain is invalid")
+    if check_balances(blocks, {}) is not None:
+        raise ValueError("The snapshot's chain spends more than a wallet holds")
+
+    computed = balance_deltas(blocks)
+    if any(abs(computed.get(key, 0.0) - balance) > 1e-6 for key, balance in wallets.items()) \
+            or not computed.keys() <= wallets.keys():
+        raise ValueError("The snapshot's balances don't match its blocks")
+
+    block_rows = []
+    transaction_rows = []
+    for block in blocks:
+        block_rows.append({
+            "id": block['index'],
+            "timestamp": parse_time(block.get('timestamp')),
+            "proof": block['proof'],
+            "previous_hash": block['previous_hash'],
+            "difficulty": block['difficulty'],
+            "hash": block['hash'],
+            "merkle_root": block.get('merkle_root'),
+        })
+        #everything the insert defaults would compute per row is filled in here
+        for t in block['transactions']:
+            transaction_rows.append({
+                "block_id": block['index'],
+                "sender": t['sender'],
+                "recipient": t['recipient'],
+                "amount": float(t['amount']),
+                "fee": float(t.get('fee', 0.0)),
+                "signature": t.get('signature'),
+                "txid": transaction_id(t, block['index']),
+                "sender_fp": key_fingerprint(t['sender']),
+                "recipient_fp": key_fingerprint(t['recipient']),
+            })
+
+    #wallets created before the import keep their rows, only their balances change
+    existing = set((await session.execute(select(Wallet.public_key))).scalars())
+    new_wallets = [{"public_key": key, "balance": balance, "reserved": 0.0}
+                   for key, balance in wallets.items() if key not in existing]
+    updated_wallets = [{"public_key": key, "balance": balance} for key, balance in wallets.items() if key in existing]
+
+    try:
+        for table, rows in ((Block, block_rows), (Transaction, transaction_rows), (Wallet, new_wallets)):
+            for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+                await session.execute(insert(table), rows[start:start + INSERT_CHUNK_SIZE])
+        if updated_wallets:
+            await session.execute(update(Wallet), updated_wallets)
+
+        await state.set_height(session, len(blocks))
+        await session.commit()
+    except BaseException:
+        await session.rollback()
+        raise
+
+    return len(blocks)
+
+
+async def export_command(args: argparse.Namespace) -> int:
+    from blockchain import BlockChain
+    from db import async_session_maker, create_db_and_tableS
+
+    await create_db_and_tableS()
+    #exported from the DB, which the block store is only a copy of
+    blockchain = BlockChain(block_store_dir=None)
+
+    #written beside the target and renamed into place, so a failed export never leaves half a snapshot
+    directory = os.path.dirname(os.path.abspath(args.file))
+    fd, partial = tempfile.mkstemp(dir=directory, prefix=".snapshot-")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            async with async_session_maker() as session:
+                async for chunk in export_snapshot(blockchain, session, args.height):
+                    f.write(chunk)
+        os.replace(partial, args.file)
+    except BaseException:
+        os.remove(partial)
+        raise
+
+    print(f"Exported a snapshot to {args.file}")
+    return 0
+
+
+async def import_command(args: argparse.Namespace) -> int:
+    import httpx
+    from blockchain import BlockChain
+    from db import async_session_maker, create_db_and_tableS
+
+    await create_db_and_tableS()
+    blockchain = BlockChain()
+
+    path = args.source
+    downloaded = None
+    try:
+        if args.source.startswith(("http://", "https://")):
+            fd, downloaded = tempfile.mkstemp(prefix="snapshot-", suffix=".gz")
+            with os.fdopen(fd, 'wb') as f:
+                async with httpx.AsyncClient(timeout=None) as client:
+                    async with client.stream('GET', args.source) as response:
+                        response.raise_for_status()
+                        async for chunk in response.aiter_raw():
+                            f.write(chunk)
+            path = downloaded
+
+        async with async_session_maker() as session:
+            height = await import_snapshot(blockchain, session, path)
+            await blockchain.load_state(session)
+            print(f"Imported {height} blocks")
+
+            #only the blocks after the snapshot are downloaded, the sync starts from the shared tip
+            for peer in args.peer:
+                await blockchain.register_node(session, peer)
+            if args.peer and await blockchain.resolve_conflicts(session):
+                print(f"Synced up to block {(await blockchain.last_block(session)).index}")
+    except ValueError as e:
+        print(f"Import failed: {e}")
+        return 1
+    finally:
+        if downloaded is not None:
+            os.remove(downloaded)
+        blockchain.validator.shutdown()
+        blockchain.miner.shutdown()
+        if blockchain.store is not None:
+            blockchain.store.close()
+        await blockchain.aclose()
+
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help="Write a snapshot of the local chain")
+    export_parser.add_argument('file')
+    export_parser.add_argument('--height', type=int, default=None, help="Height to export, the tip by default")
+
+    import_parser = commands.add_parser('import', help="Bootstrap an empty node from a snapshot")
+    import_parser.add_argument('source', help="A snapshot file, or the URL of a node's /snapshot")
+    import_parser.add_argument('--peer', action='append', default=[],
+                               help="Sync the blocks after the snapshot from this node, can be repeated")
+
+    args = parser.parse_args()
+    command = export_command if args.command == 'export' else import_command
+    try:
+        return asyncio.run(command(args))
+    except ValueError as e:
+        print(e)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""This python file contains the balance state: wallet balances derived from the blocks, with periodic snapshots"""
+from collections import defaultdict
+
+from sqlalchemy import select, update, delete, insert, func, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import Wallet, Transaction, BalanceSnapshot, ChainState
+
+#A snapshot is taken once the balances are this many blocks past the last one, and this many are kept
+SNAPSHOT_INTERVAL = 100
+SNAPSHOTS_KEPT = 3
+
+#Wallets looked up per query by balances(), keeping each IN list well inside SQLite's parameter limit
+BALANCE_QUERY_CHUNK = 500
+
+
+async def get_height(session: AsyncSession) -> int:
+    """
+    Returns the block the balances have been applied up to
+    """
+    state = await session.get(ChainState, 1)
+    return state.height if state is not None else 0
+
+
+async def balances(session: AsyncSession, public_keys) -> dict[str, float]:
+    """
+    Returns the balances of the given wallets, leaving out those which have no row yet
+    """
+    keys = list(public_keys)
+    found: dict[str, float] = {}
+    for start in range(0, len(keys), BALANCE_QUERY_CHUNK):
+        result = await session.execute(
+            select(Wallet.public_key, Wallet.balance)
+            .where(Wallet.public_key.in_(keys[start:start + BALANCE_QUERY_CHUNK]))
+        )
+        found.update(result.all())
+    return found
+
+
+async def credit(session: AsyncSession, deltas: dict[str, float]) -> None:
+    """
+    Adds each delta to its wallet's balance, creating wallets which don't exist yet
+    """
+    for public_key, delta in deltas.items():
+        result = await session.execute(
+            update(Wallet)
+            .where(Wallet.public_key == public_key)
+            .values(balance=Wallet.balance + delta)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            session.add(Wallet(public_key=public_key, balance=delta, reserved=0.0))
+
+    await session.flush()
+
+
+async def debit(session: AsyncSession, public_key: str, amount: float) -> bool:
+    """
+    Takes amount off a balance in one conditional UPDATE, so concurrent debits can never overdraw it
+    :return: <bool> False if the balance doesn't cover the amount, in which case nothing changed
+    """
+    result = await session.execute(
+        update(Wallet)
+        .where(Wallet.public_key == public_key, Wallet.balance >= amount)
+        .values(balance=Wallet.balance - amount)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+async def reserve(session: AsyncSession, public_key: str, amount: float) -> bool:
+    """
+    Holds amount of a balance for a pending transaction, in one conditional UPDATE
+    :return: <bool> False if the unreserved balance doesn't cover the amount, in which case nothing changed
+    """
+    result = await session.execute(
+        update(Wallet)
+        .where(Wallet.public_key == public_key, Wallet.balance - Wallet.reserved >= amount)
+        .values(reserved=Wallet.reserved + amount)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+async def release(session: AsyncSession, public_key: str, amount: float) -> None:
+    """
+    Gives back an amount held by reserve(), once its transaction has left the mempool
+    """
+    await session.execute(
+        update(Wallet)
+        .where(Wallet.public_key == public_key)
+        .values(reserved=Wallet.reserved - amount)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def clear_reservations(session: AsyncSession) -> None:
+    await session.execute(update(Wallet).values(reserved=0.0).execution_options(synchronize_session=False))
+
+
+async def set_height(session: AsyncSession, height: int) -> None:
+    """
+    Records that the balances are applied up to block `height`, taking a snapshot if one is due
+    """
+    state = await session.get(ChainState, 1)
+    if state is None:
+        session.add(ChainState(id=1, height=height))
+    else:
+        state.height = height
+
+    await _maybe_snapshot(session, height)
+
+
+async def rebuild(session: AsyncSession, height: int) -> None:
+    """
+    Recomputes the balances as of block `height`: the nearest snapshot at or below it is restored and only
+    the blocks after it are replayed. Balances are sums, so the replay is one grouped query per direction.
+    """
+    result = await session.execute(
+        select(func.max(BalanceSnapshot.block_index)).where(BalanceSnapshot.block_index <= height)
+    )
+    base = result.scalar_one_or_none() or 0
+
+    deltas: dict[str, float] = defaultdict(float)
+    if base > 0:
+        result = await session.execute(
+            select(BalanceSnapshot.public_key, BalanceSnapshot.balance).where(BalanceSnapshot.block_index == base)
+        )
+        for public_key, balance in result:
+            deltas[public_key] += balance
+
+    in_range = (Transaction.block_id > base, Transaction.block_id <= height)
+
+    result = await session.execute(
+        select(Transaction.recipient, func.sum(Transaction.amount)).where(*in_range).group_by(Transaction.recipient)
+    )
+    for public_key, received in result:
+        deltas[public_key] += received
+
+    result = await session.execute(
+        select(Transaction.sender, func.sum(Transaction.amount + Transaction.fee))
+        .where(*in_range, Transaction.sender != "0")
+        .group_by(Transaction.sender)
+    )
+    for public_key, sent in result:
+        deltas[public_key] -= sent
+
+    await session.execute(update(Wallet).values(balance=0.0).execution_options(synchronize_session=False))
+    await credit(session, deltas)
+    await set_height(session, height)
+
+
+async def discard_snapshots_from(session: AsyncSession, index: int) -> None:
+    """
+    Drops the snapshots of blocks from index onwards, eg. when those blocks are replaced in a reorg
+    """
+    await session.execute(delete(BalanceSnapshot).where(BalanceSnapshot.block_index >= index))
+
+
+async def _maybe_snapshot(session: AsyncSession, height: int) -> None:
+    result = await session.execute(select(func.max(BalanceSnapshot.block_index)))
+    latest = result.scalar_one_or_none() or 0
+    if height - latest < SNAPSHOT_INTERVAL:
+        return
+
+    await session.execute(
+        insert(BalanceSnapshot).from_select(
+            ["block_index", "public_key", "balance"],
+            select(literal(height), Wallet.public_key, Wallet.balance),
+        )
+    )
+
+    result = await session.execute(
+        select(BalanceSnapshot.block_index).distinct()
+        .order_by(BalanceSnapshot.block_index.desc())
+        .offset(SNAPSHOTS_KEPT - 1).limit(1)
+    )
+    oldest_kept = result.scalar_one_or_none()
+    if oldest_kept is not None:
+        await session.execute(delete(BalanceSnapshot).where(BalanceSnapshot.block_index < oldest_kept))
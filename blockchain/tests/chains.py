@@ -0,0 +1,47 @@
+"""Builds blocks for the tests, on top of the chains bench.seed_chain makes"""
+import copy
+import hashlib
+from datetime import timedelta
+
+from blockchain import MINING_REWARD
+from difficulty import TARGET_BLOCK_TIME
+from encoding import block_header, parse_time, time_format, transactions_root
+
+
+async def next_block(miner, parent: dict, transfers: list[dict], recipient: str = "miner") -> dict:
+    """
+    Mines a block on top of parent holding the transfers, after a coinbase paying their fees
+    """
+    reward = {"sender": "0", "recipient": recipient, "fee": 0.0, "signature": None,
+              "amount": MINING_REWARD + sum(t.get('fee', 0.0) for t in transfers)}
+    block = {
+        "index": parent['index'] + 1,
+        "timestamp": time_format(parse_time(parent['timestamp']) + timedelta(seconds=TARGET_BLOCK_TIME)),
+        "transactions": [reward] + copy.deepcopy(transfers),
+        "previous_hash": parent['hash'],
+        "difficulty": parent['difficulty'],
+    }
+    return await seal(miner, parent, block)
+
+
+async def seal(miner, parent: dict, block: dict) -> dict:
+    """
+    Fills in the merkle root, a proof on top of parent's and the hash, eg. after a block was edited
+    """
+    block['merkle_root'] = transactions_root(block)
+    block['proof'] = await miner.proof_of_work(parent['proof'], block['difficulty'])
+    block['hash'] = hashlib.sha256(block_header(block, block['merkle_root'])).hexdigest()
+    return block
+
+
+def relink(chain: list[dict]) -> list[dict]:
+    """
+    Recomputes the merkle roots, hashes and links of edited blocks. Proofs only depend on the previous proof,
+    so they stay valid
+    """
+    previous_hash = chain[0]['previous_hash']
+    for block in chain:
+        block['previous_hash'] = previous_hash
+        block['merkle_root'] = transactions_root(block)
+        block['hash'] = previous_hash = hashlib.sha256(block_header(block, block['merkle_root'])).hexdigest()
+    return chain
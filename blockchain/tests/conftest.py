@@ -0,0 +1,69 @@
+"""Shared fixtures: the node's modules on the path, and a scratch SQLite database for the tests which need one"""
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+#db.py binds its engine on import, so the scratch database has to be chosen before anything imports it
+_scratch = tempfile.mkdtemp(prefix="blockchain-tests-")
+os.environ["BLOCKCHAIN_DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_scratch, 'blockchain.db')}"
+os.environ.pop("BLOCKCHAIN_BLOCK_STORE", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def run():
+    """
+    Runs a coroutine to completion. The engine's connections belong to the loop that opened them, so they
+    are dropped before the loop closes
+    """
+    from db import engine
+
+    def runner(coroutine):
+        async def wrapped():
+            try:
+                return await coroutine
+            finally:
+                await engine.dispose()
+        return asyncio.run(wrapped())
+
+    return runner
+
+
+@pytest.fixture
+def fresh_db(run):
+    """
+    Empties the scratch database
+    """
+    from db import Base, engine
+
+    async def reset():
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.drop_all)
+            await connection.run_sync(Base.metadata.create_all)
+
+    run(reset())
+
+
+@pytest.fixture
+def blockchain(fresh_db):
+    """
+    A BlockChain on the empty scratch database, without a block store
+    """
+    from blockchain import BlockChain
+
+    chain = BlockChain(block_store_dir=None)
+    yield chain
+    chain.miner.shutdown()
+    chain.validator.shutdown()
+    chain.verifier.shutdown()
+
+
+@pytest.fixture(scope="module")
+def run_module():
+    """
+    Runs a coroutine which needs no database, for fixtures shared by a module
+    """
+    return asyncio.run
@@ -0,0 +1,71 @@
+"""The mempool: dedup, fee ordering and eviction"""
+import pytest
+
+from encoding import transaction_id
+from mempool import Mempool
+
+
+def transaction(i: int, fee: float = 0.0, sender: str = "alice") -> dict:
+    return {"sender": sender, "recipient": "bob", "amount": 1.0 + i, "fee": fee, "signature": f"sig{i}"}
+
+
+def test_same_transaction_is_only_pending_once():
+    pool = Mempool()
+    tx_id, evicted = pool.add(transaction(1))
+
+    assert tx_id == transaction_id(transaction(1))
+    assert evicted == []
+    with pytest.raises(ValueError):
+        pool.add(transaction(1))
+    assert len(pool) == 1
+
+
+def test_select_takes_highest_fee_first_then_earliest():
+    pool = Mempool()
+    for i, fee in enumerate([0.1, 0.3, 0.1, 0.2]):
+        pool.add(transaction(i, fee))
+
+    assert [t['signature'] for t in pool.select(10)] == ["sig1", "sig3", "sig0", "sig2"]
+    assert [t['signature'] for t in pool.select(2)] == ["sig1", "sig3"]
+    #selecting leaves them in the pool until they are removed
+    assert len(pool) == 4
+
+
+def test_removed_then_added_again_is_selected_once():
+    pool = Mempool()
+    tx_id, _ = pool.add(transaction(1, 0.5))
+    pool.remove([tx_id])
+    pool.add(transaction(1, 0.5))
+
+    assert len(pool.select(10)) == 1
+
+
+def test_full_pool_evicts_the_lowest_fee():
+    pool = Mempool(max_count=3)
+    for i, fee in enumerate([0.2, 0.1, 0.3]):
+        pool.add(transaction(i, fee))
+
+    _, evicted = pool.add(transaction(3, 0.4))
+    assert [t['signature'] for t in evicted] == ["sig1"]
+    assert len(pool) == 3
+    assert transaction_id(transaction(1, 0.1)) not in pool
+
+
+def test_full_pool_refuses_a_lower_fee():
+    pool = Mempool(max_count=2)
+    pool.add(transaction(0, 0.2))
+    pool.add(transaction(1, 0.3))
+
+    with pytest.raises(ValueError):
+        pool.add(transaction(2, 0.1))
+    assert len(pool) == 2
+
+
+def test_byte_budget_is_kept_and_released():
+    pool = Mempool()
+    tx_id, _ = pool.add(transaction(1))
+    assert pool.size_bytes > 0
+
+    assert pool.remove([tx_id, "unknown"]) == [transaction(1)]
+    assert pool.size_bytes == 0
+    assert len(pool) == 0
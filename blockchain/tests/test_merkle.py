@@ -0,0 +1,54 @@
+"""Merkle roots and inclusion proofs"""
+import hashlib
+
+import pytest
+
+from merkle import EMPTY_ROOT, merkle_proof, merkle_root, verify_proof
+
+
+def ids(count: int) -> list[str]:
+    return [hashlib.sha256(str(i).encode()).hexdigest() for i in range(count)]
+
+
+def test_empty_block_has_the_empty_root():
+    assert merkle_root([]) == EMPTY_ROOT
+
+
+def test_single_transaction_is_its_own_root():
+    tx_ids = ids(1)
+    assert merkle_root(tx_ids) == tx_ids[0]
+    assert merkle_proof(tx_ids, 0) == []
+
+
+@pytest.mark.parametrize("count", range(1, 10))
+def test_every_position_proves_against_the_root(count):
+    tx_ids = ids(count)
+    root = merkle_root(tx_ids)
+    for position, tx_id in enumerate(tx_ids):
+        assert verify_proof(tx_id, merkle_proof(tx_ids, position), root)
+
+
+def test_proof_fails_for_another_transaction_or_root():
+    tx_ids = ids(5)
+    root = merkle_root(tx_ids)
+    proof = merkle_proof(tx_ids, 2)
+
+    assert not verify_proof(tx_ids[3], proof, root)
+    assert not verify_proof(tx_ids[2], proof, merkle_root(ids(6)))
+
+
+def test_tampered_or_malformed_proof_fails():
+    tx_ids = ids(4)
+    root = merkle_root(tx_ids)
+    proof = merkle_proof(tx_ids, 1)
+
+    flipped = [dict(step) for step in proof]
+    flipped[0]['side'] = "left" if flipped[0]['side'] == "right" else "right"
+    assert not verify_proof(tx_ids[1], flipped, root)
+    assert not verify_proof(tx_ids[1], [{"hash": "not hex", "side": "left"}], root)
+    assert not verify_proof(tx_ids[1], [{"side": "left"}], root)
+
+
+def test_order_of_transactions_changes_the_root():
+    tx_ids = ids(3)
+    assert merkle_root(tx_ids) != merkle_root(list(reversed(tx_ids)))
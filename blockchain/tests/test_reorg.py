@@ -0,0 +1,132 @@
+"""Reorgs: balances rebuilt at the fork point, and the transfers of dropped blocks returned to the mempool"""
+import pytest
+from sqlalchemy import select
+
+import bench
+import state
+from chains import next_block
+from db import BalanceSnapshot, Wallet, async_session_maker
+from encoding import transaction_id
+from keys import generate_keypair
+from miner import Miner
+from signatures import sign, signed_fields
+from snapshot import balance_deltas
+
+
+@pytest.fixture
+def miner():
+    miner = Miner()
+    yield miner
+    miner.shutdown()
+
+
+async def funded_chain(miner, sender: str, private_key: str, recipient: str) -> tuple[list[dict], dict]:
+    """
+    A seeded chain, then a block paying its reward to sender, then one where sender pays recipient 0.5
+    :return: <tuple> The chain, and the transfer
+    """
+    chain = await bench.seed_chain(2, 1)
+    chain.append(await next_block(miner, chain[-1], [], recipient=sender))
+
+    transfer = {"sender": sender, "recipient": recipient, "amount": 0.5, "fee": 0.01}
+    transfer['signature'] = sign(private_key, signed_fields(transfer))
+    chain.append(await next_block(miner, chain[-1], [transfer]))
+    return chain, transfer
+
+
+async def balance(session, public_key: str) -> float:
+    session.expire_all()
+    wallet = await session.get(Wallet, public_key)
+    return wallet.balance if wallet is not None else 0.0
+
+
+def test_reorg_rebuilds_balances_and_requeues_dropped_transfers(run, blockchain, miner):
+    async def scenario():
+        sender, private_key = generate_keypair("ed25519")
+        recipient, _ = generate_keypair("ed25519")
+        chain, transfer = await funded_chain(miner, sender, private_key, recipient)
+
+        async with async_session_maker() as session:
+            for block in chain:
+                assert await blockchain.receive_block(session, block) == "appended"
+            assert await balance(session, sender) == pytest.approx(0.49)
+            assert await balance(session, recipient) == pytest.approx(0.5)
+
+            #a longer fork from block 3 which leaves the transfer out
+            fork = [await next_block(miner, chain[2], [])]
+            fork.append(await next_block(miner, fork[-1], []))
+            assert await blockchain.valid_chain(fork, chain[:3])
+            assert await blockchain.replace_chain(session, fork)
+
+            assert (await blockchain.last_block(session)).hash == fork[-1]['hash']
+            assert await balance(session, sender) == pytest.approx(1.0)
+            assert await balance(session, recipient) == 0.0
+
+            assert transaction_id(transfer) in blockchain.mempool
+            assert (await session.get(Wallet, sender)).reserved == pytest.approx(0.51)
+        await blockchain.aclose()
+
+    run(scenario())
+
+
+def test_reorg_keeps_transfers_the_new_blocks_hold_out_of_the_mempool(run, blockchain, miner):
+    async def scenario():
+        sender, private_key = generate_keypair("ed25519")
+        recipient, _ = generate_keypair("ed25519")
+        chain, transfer = await funded_chain(miner, sender, private_key, recipient)
+
+        async with async_session_maker() as session:
+            for block in chain:
+                assert await blockchain.receive_block(session, block) == "appended"
+
+            #the fork mines the same transfer in a different block 4, on a different coinbase
+            fork = [await next_block(miner, chain[2], [transfer], recipient=recipient)]
+            fork.append(await next_block(miner, fork[-1], []))
+            assert await blockchain.replace_chain(session, fork)
+
+            assert transaction_id(transfer) not in blockchain.mempool
+            assert await balance(session, sender) == pytest.approx(0.49)
+            assert await balance(session, recipient) == pytest.approx(0.5 + 1.01)
+        await blockchain.aclose()
+
+    run(scenario())
+
+
+async def snapshot_heights(session) -> list[int]:
+    result = await session.execute(select(BalanceSnapshot.block_index).distinct().order_by(BalanceSnapshot.block_index))
+    return list(result.scalars())
+
+
+def test_reorg_past_snapshots_rebuilds_balances_from_an_earlier_one(run, blockchain, miner, monkeypatch):
+    monkeypatch.setattr(state, "SNAPSHOT_INTERVAL", 3)
+
+    async def scenario():
+        chain = await bench.seed_chain(10, 2)
+
+        async with async_session_maker() as session:
+            for block in chain:
+                assert await blockchain.receive_block(session, block) == "appended"
+            assert await snapshot_heights(session) == [3, 6, 9]
+
+            #a longer fork from block 5, past the snapshots taken at blocks 6 and 9, so balances rebuild from block 3
+            fork = [await next_block(miner, chain[4], [])]
+            for _ in range(6):
+                fork.append(await next_block(miner, fork[-1], []))
+            assert await blockchain.replace_chain(session, fork)
+
+            assert (await blockchain.last_block(session)).index == 12
+
+            expected = balance_deltas(chain[:5] + fork)
+            for public_key, amount in expected.items():
+                assert await balance(session, public_key) == pytest.approx(amount)
+
+            #the snapshots of replaced blocks are gone, the one taken at the new tip holds its balances
+            assert await snapshot_heights(session) == [3, 12]
+            result = await session.execute(
+                select(BalanceSnapshot.public_key, BalanceSnapshot.balance).where(BalanceSnapshot.block_index == 12)
+            )
+            for public_key, amount in result.all():
+                assert amount == pytest.approx(expected.get(public_key, 0.0))
+        await blockchain.aclose()
+
+    run(scenario())
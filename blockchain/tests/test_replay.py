@@ -0,0 +1,69 @@
+"""A transfer is only ever paid once, however the block carrying it again arrives"""
+import pytest
+
+import bench
+from chains import next_block
+from db import Wallet, async_session_maker
+from miner import Miner
+
+
+@pytest.fixture
+def miner():
+    miner = Miner()
+    yield miner
+    miner.shutdown()
+
+
+def test_announced_block_replaying_a_transfer_is_refused(run, blockchain, miner):
+    async def scenario():
+        chain = await bench.seed_chain(3, 2)
+        sender = chain[1]['transactions'][1]['sender']
+        async with async_session_maker() as session:
+            for block in chain:
+                assert await blockchain.receive_block(session, block) == "appended"
+            before = (await session.get(Wallet, sender)).balance
+
+            replay = await next_block(miner, chain[-1], [chain[1]['transactions'][1]])
+            assert await blockchain.receive_block(session, replay) == "invalid"
+
+            session.expire_all()
+            assert (await session.get(Wallet, sender)).balance == before
+        await blockchain.aclose()
+
+    run(scenario())
+
+
+def test_transfer_repeated_inside_new_blocks_is_invalid(run, blockchain, miner):
+    async def scenario():
+        chain = await bench.seed_chain(2, 2)
+        transfer = chain[1]['transactions'][1]
+
+        twice = await next_block(miner, chain[-1], [transfer, transfer])
+        assert not await blockchain.valid_chain([twice], chain)
+
+        again = await next_block(miner, chain[0], [transfer])
+        later = await next_block(miner, again, [transfer])
+        assert not await blockchain.valid_chain([again, later], chain[:1])
+        await blockchain.aclose()
+
+    run(scenario())
+
+
+def test_fork_replaying_a_transfer_from_before_it_is_refused(run, blockchain, miner):
+    async def scenario():
+        chain = await bench.seed_chain(4, 2)
+        async with async_session_maker() as session:
+            for block in chain:
+                assert await blockchain.receive_block(session, block) == "appended"
+
+            #the fork keeps blocks 1 and 2, and pays block 2's first transfer again in its own block 3
+            fork = [await next_block(miner, chain[1], [chain[1]['transactions'][1]])]
+            fork.append(await next_block(miner, fork[0], []))
+            fork.append(await next_block(miner, fork[1], []))
+            assert await blockchain.valid_chain(fork, chain[:2])
+
+            assert not await blockchain.replace_chain(session, fork)
+            assert (await blockchain.last_block(session)).hash == chain[-1]['hash']
+        await blockchain.aclose()
+
+    run(scenario())
@@ -0,0 +1,33 @@
+"""resolve_conflicts against peers which answer the probe, then stall"""
+import asyncio
+import time
+
+import blockchain as blockchain_module
+from db import async_session_maker
+
+
+def test_slow_peers_cannot_stall_a_resolve(run, blockchain, monkeypatch):
+    monkeypatch.setattr(blockchain_module, "RESOLVE_TIMEOUT", 0.5)
+
+    async def peer_get(node, path, **params):
+        return {"length": 10, "tip_hash": f"tip of {node}"}
+
+    async def peer_get_chain(node, from_index, limit):
+        #each page takes as long as a peer request may, the resolve has to give up first
+        await asyncio.sleep(blockchain_module.PEER_TIMEOUT)
+        return None
+
+    monkeypatch.setattr(blockchain, "_peer_get", peer_get)
+    monkeypatch.setattr(blockchain, "_peer_get_chain", peer_get_chain)
+
+    async def scenario():
+        async with async_session_maker() as session:
+            for port in range(5001, 5005):
+                await blockchain.register_node(session, f"http://127.0.0.1:{port}")
+
+            started = time.monotonic()
+            assert not await blockchain.resolve_conflicts(session)
+            assert time.monotonic() - started < 1.5
+        await blockchain.aclose()
+
+    run(scenario())
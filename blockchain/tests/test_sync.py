@@ -0,0 +1,49 @@
+"""Round trips between two nodes: a peer run as its own uvicorn process, and a BlockChain syncing from it"""
+import httpx
+
+import bench
+from db import Wallet, async_session_maker
+from signatures import sign, signed_fields
+
+
+async def mine_integer_transfer(url: str) -> tuple[str, dict]:
+    """
+    Has the peer mine a transfer whose amount was sent as the JSON integer 1
+    :return: <tuple> The recipient, and the peer's /chain
+    """
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+        wallet = (await client.post('/wallet/create')).json()['data']['data']
+        for _ in range(2):
+            (await client.get('/mine')).raise_for_status()
+        recipient = (await client.post('/wallet/create')).json()['data']['data']['publicKey']
+
+        transaction = {"sender": wallet['publicKey'], "recipient": recipient, "amount": 1}
+        response = await client.post('/new_transaction', json={
+            **transaction, "signature": sign(wallet['privateKey'], signed_fields(transaction))
+        })
+        assert response.status_code == 200, response.text
+
+        #mining pays the last wallet created, which mustn't be the recipient
+        (await client.post('/wallet/create')).raise_for_status()
+        (await client.get('/mine')).raise_for_status()
+
+        return recipient, (await client.get('/chain')).json()['chain']
+
+
+def test_sync_chain_with_integer_amount(run, blockchain):
+    async def scenario():
+        async with bench.run_peers(1) as peers:
+            recipient, peer_chain = await mine_integer_transfer(peers[0])
+            assert await blockchain.valid_chain(peer_chain)
+
+            async with async_session_maker() as session:
+                await blockchain.register_node(session, peers[0])
+                assert await blockchain.resolve_conflicts(session)
+
+                chain = await blockchain.get_chain(session)
+                assert [block['hash'] for block in chain] == [block['hash'] for block in peer_chain]
+                assert await blockchain.valid_chain(chain)
+                assert (await session.get(Wallet, recipient)).balance == 1.0
+        await blockchain.aclose()
+
+    run(scenario())
@@ -0,0 +1,84 @@
+"""Transactions submitted through the API: what is refused before it reaches the mempool"""
+import json
+
+import httpx
+import pytest
+
+from signatures import sign, signed_fields
+
+
+@pytest.fixture
+def node(run, fresh_db, monkeypatch):
+    """
+    Runs a scenario against the app in process, with a funded wallet and a recipient. The app gets its own
+    BlockChain, the module's one remembers the tip and mempool of whatever ran before
+    """
+    import api
+    from api import app
+    from blockchain import BlockChain
+
+    monkeypatch.setattr(api, "blockchain", BlockChain())
+
+    def runner(scenario):
+        async def wrapped():
+            async with app.router.lifespan_context(app):
+                transport = httpx.ASGITransport(app=app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+                    wallet = (await client.post('/wallet/create')).json()['data']['data']
+                    for _ in range(2):
+                        (await client.get('/mine')).raise_for_status()
+                    recipient = (await client.post('/wallet/create')).json()['data']['data']['publicKey']
+                    await scenario(client, wallet, recipient)
+        run(wrapped())
+
+    return runner
+
+
+def signed(wallet: dict, recipient: str, amount, fee=None) -> dict:
+    transaction = {"sender": wallet['publicKey'], "recipient": recipient, "amount": amount}
+    if fee is not None:
+        transaction['fee'] = fee
+    return {**transaction, "signature": sign(wallet['privateKey'], signed_fields(transaction))}
+
+
+async def post(client, path: str, body: dict) -> httpx.Response:
+    #sent by hand, so NaN gets through the way a careless client would send it
+    return await client.post(path, content=json.dumps(body), headers={"content-type": "application/json"})
+
+
+@pytest.mark.parametrize("amount", [-1.0, 0, "1", True, float("nan")])
+def test_invalid_amount_is_refused(node, amount):
+    async def scenario(client, wallet, recipient):
+        response = await post(client, '/new_transaction', signed(wallet, recipient, amount))
+        assert response.status_code == 400
+
+        response = await post(client, '/transactions/batch', {"transactions": [signed(wallet, recipient, amount)]})
+        assert response.json()['accepted'] == 0
+
+    node(scenario)
+
+
+@pytest.mark.parametrize("fee", [-0.1, "0.1", True, float("nan"), float("inf")])
+def test_invalid_fee_is_refused(node, fee):
+    async def scenario(client, wallet, recipient):
+        response = await post(client, '/new_transaction', signed(wallet, recipient, 0.5, fee))
+        assert response.status_code == 400
+        assert "Fee" in response.json()['detail']
+
+        response = await post(client, '/transactions/batch', {"transactions": [signed(wallet, recipient, 0.5, fee)]})
+        assert response.json()['accepted'] == 0
+
+    node(scenario)
+
+
+def test_mined_transaction_cannot_be_submitted_again(node):
+    async def scenario(client, wallet, recipient):
+        transaction = signed(wallet, recipient, 1)
+        assert (await post(client, '/new_transaction', transaction)).status_code == 200
+        (await client.get('/mine')).raise_for_status()
+
+        response = await post(client, '/new_transaction', transaction)
+        assert response.status_code == 400
+        assert response.json()['detail'] == "Transaction is already mined"
+
+    node(scenario)
@@ -0,0 +1,106 @@
+"""Chain validation: check_range, check_transactions and check_balances"""
+import copy
+
+import pytest
+
+import bench
+from chains import relink
+from difficulty import RETARGET_INTERVAL
+from blockchain import MINING_REWARD
+from validation import check_balances, check_range, check_transactions
+
+
+@pytest.fixture(scope="module")
+def seeded(run_module):
+    #one chain past the first retarget, mined once for the whole module
+    return run_module(bench.seed_chain(RETARGET_INTERVAL + 2, 2))
+
+
+@pytest.fixture
+def chain(seeded):
+    return copy.deepcopy(seeded)
+
+
+def test_seeded_chain_is_valid(chain):
+    assert check_range(chain, 0, True) is None
+
+
+def test_missing_timestamps_are_invalid_not_an_error(chain):
+    for block in chain:
+        block['timestamp'] = None
+    assert check_range(relink(chain), 0, True) == 0
+
+    #a chain whose first block is fine still stops at the first block without one
+    chain[0]['timestamp'] = "2024-01-01 00:00:00"
+    assert check_range(relink(chain), 0, True) == 1
+
+
+def test_unparseable_timestamp_is_invalid(chain):
+    chain[3]['timestamp'] = "yesterday"
+    assert check_range(relink(chain), 0, True) == 3
+
+
+def test_timestamp_before_the_parent_is_invalid(chain):
+    chain[5]['timestamp'] = chain[3]['timestamp']
+    assert check_range(relink(chain), 0, True) == 5
+
+
+def test_timestamp_equal_to_the_parent_is_valid(chain):
+    chain[-1]['timestamp'] = chain[-2]['timestamp']
+    assert check_range(relink(chain), 0, True) is None
+
+
+def test_block_with_transfers_has_valid_transactions(chain):
+    assert all(check_transactions(block, MINING_REWARD) for block in chain)
+
+
+@pytest.mark.parametrize("edit", [
+    lambda txs: txs[0].update(amount=txs[0]['amount'] + 1),
+    lambda txs: txs.pop(0),
+    lambda txs: txs.append(dict(txs[0])),
+    lambda txs: txs.clear(),
+    lambda txs: txs[1].update(amount=-0.1),
+    lambda txs: txs[1].update(amount=0),
+    lambda txs: txs[1].update(amount=True),
+    lambda txs: txs[1].update(amount=float("nan")),
+    lambda txs: txs[1].update(fee=float("inf")),
+    lambda txs: txs[1].update(fee=-0.01),
+    lambda txs: txs[1].update(signature=None),
+    lambda txs: txs[1].pop('recipient'),
+], ids=["coinbase amount", "no coinbase", "second coinbase", "no transactions", "negative amount",
+        "zero amount", "bool amount", "nan amount", "infinite fee", "negative fee", "no signature",
+        "no recipient"])
+def test_malformed_transactions_are_invalid(chain, edit):
+    block = chain[2]
+    edit(block['transactions'])
+    assert not check_transactions(block, MINING_REWARD)
+
+
+def test_balances_follow_the_blocks(chain):
+    balances = {}
+    assert check_balances(chain, balances) is None
+
+    sender = chain[0]['transactions'][0]['recipient']
+    spent = sum(t['amount'] + t['fee'] for block in chain[1:] for t in block['transactions'][1:])
+    earned = sum(block['transactions'][0]['amount'] for block in chain)
+    assert balances[sender] == pytest.approx(earned - spent)
+
+
+def test_overdraw_is_found_at_its_block(chain):
+    sender = chain[0]['transactions'][0]['recipient']
+    chain[4]['transactions'][1]['amount'] = 1000.0
+
+    balances = {}
+    assert check_balances(chain, balances) == 4
+    #the blocks before the overdraw were applied
+    assert balances[sender] > 0
+
+
+def test_credits_only_count_after_a_block_debits():
+    #the reward arrives in the same block as the transfer it would pay for, which is too late
+    block = {"transactions": [
+        {"sender": "0", "recipient": "alice", "amount": MINING_REWARD, "fee": 0.0, "signature": None},
+        {"sender": "alice", "recipient": "bob", "amount": 0.5, "fee": 0.0, "signature": "sig"},
+    ]}
+    assert check_balances([block], {}) == 0
+    assert check_balances([block], {"alice": 0.5}) is None
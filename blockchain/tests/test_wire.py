@@ -0,0 +1,63 @@
+"""The binary chain encoding peers sync with"""
+import pytest
+
+import bench
+from validation import check_range
+from wire import MAGIC, ChainDecoder, ChainEncoder
+
+
+@pytest.fixture(scope="module")
+def chain(run_module):
+    return run_module(bench.seed_chain(5, 3))
+
+
+def test_round_trip_gives_back_the_blocks(chain):
+    payload = ChainEncoder().encode(chain, length=len(chain), next_index=None)
+
+    decoder = ChainDecoder()
+    assert decoder.feed(payload) == chain
+    assert decoder.finished
+    assert decoder.length == len(chain)
+    assert decoder.next_index is None
+
+
+def test_decoded_chain_still_validates(chain):
+    decoder = ChainDecoder()
+    blocks = decoder.feed(ChainEncoder().encode(chain, length=len(chain), next_index=None))
+    assert check_range(blocks, 0, True) is None
+
+
+def test_payload_can_arrive_a_byte_at_a_time(chain):
+    payload = ChainEncoder().encode(chain[:2], length=len(chain), next_index=3)
+
+    decoder = ChainDecoder()
+    blocks = []
+    for i in range(len(payload)):
+        blocks.extend(decoder.feed(payload[i:i + 1]))
+
+    assert blocks == chain[:2]
+    assert decoder.next_index == 3
+
+
+def test_truncated_payload_is_not_finished(chain):
+    payload = ChainEncoder().encode(chain, length=len(chain), next_index=None)
+
+    decoder = ChainDecoder()
+    assert decoder.feed(payload[:-1]) == chain
+    assert not decoder.finished
+
+    assert decoder.feed(payload[-1:]) == []
+    assert decoder.finished
+
+
+def test_integer_amounts_come_back_as_floats(chain):
+    block = dict(chain[1], transactions=[dict(t, amount=1) for t in chain[1]['transactions']])
+    decoded = ChainDecoder().feed(ChainEncoder().encode([block], length=1, next_index=None))[0]
+    assert all(isinstance(t['amount'], float) and t['amount'] == 1.0 for t in decoded['transactions'])
+
+
+def test_anything_else_is_refused():
+    with pytest.raises(ValueError):
+        ChainDecoder().feed(b"{\"chain\": []}")
+    with pytest.raises(ValueError):
+        ChainDecoder().feed(MAGIC + b"X")
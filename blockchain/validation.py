@@ -0,0 +1,221 @@
+"""This python file contains the chain validation engine, which checks chunks of a chain in a process pool"""
+import asyncio
+import hashlib
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from difficulty import INITIAL_DIFFICULTY, RETARGET_INTERVAL, is_retarget_height, retarget, valid_proof
+from encoding import block_header, parse_time, transactions_root
+
+#Chains shorter than this are checked in a single task, splitting them costs more than it saves
+VALIDATION_CHUNK_SIZE = 2000
+
+
+def check_range(blocks: list[dict], start: int, genesis: bool) -> int | None:
+    """
+    Checks blocks[start:] against the blocks before them. blocks[:start] are only read, never checked:
+    they hold the link to the previous block and the retarget window.
+    :param blocks: <list> A slice of the chain
+    :param start: <int> Position of the first block to check
+    :param genesis: <bool> True if blocks[0] is the first block of the chain
+    :return: <int> Position of the first invalid block, or None if they are all valid
+    """
+
+    position = start
+
+    try:
+        if genesis and position == 0:
+            first = blocks[0]
+            first_root = transactions_root(first)
+            first_hash = hashlib.sha256(block_header(first, first_root)).hexdigest()
+            if first['index'] != 1 or first['difficulty'] != INITIAL_DIFFICULTY:
+                return 0
+            if parse_time(first['timestamp']) is None:
+                return 0
+            if first.get('merkle_root', first_root) != first_root:
+                return 0
+            if first.get('hash', first_hash) != first_hash:
+                return 0
+            position = 1
+
+        if position >= len(blocks):
+            return None
+
+        last_hash = hashlib.sha256(block_header(blocks[position - 1])).hexdigest()
+        last_time = parse_time(blocks[position - 1]['timestamp'])
+
+        while position < len(blocks):
+            block = blocks[position]
+            last_block = blocks[position - 1]
+
+            if block['index'] != last_block['index'] + 1:
+                return position
+
+            if block['previous_hash'] != last_hash:
+                return position
+
+            #the retarget reads the timestamps, so each must be there and must not go back in time
+            timestamp = parse_time(block['timestamp'])
+            if timestamp is None or last_time is None or timestamp < last_time:
+                return position
+
+            #a claimed merkle root must be the one the transactions give
+            root = transactions_root(block)
+            if block.get('merkle_root', root) != root:
+                return position
+
+            block_hash = hashlib.sha256(block_header(block, root)).hexdigest()
+            if block.get('hash', block_hash) != block_hash:
+                return position
+
+            #the difficulty must follow the retarget schedule
+            expected = last_block['difficulty']
+            if is_retarget_height(last_block['index']):
+                window_start = parse_time(blocks[position - RETARGET_INTERVAL]['timestamp'])
+                expected = retarget(expected, window_start, parse_time(last_block['timestamp']))
+
+            if block['difficulty'] != expected:
+                return position
+
+            if not valid_proof(last_block['proof'], block['proof'], block['difficulty']):
+                return position
+
+            last_hash = block_hash
+            last_time = timestamp
+            position += 1
+
+    except (KeyError, TypeError, ValueError, IndexError, AttributeError):
+        #peers can send anything, a malformed block makes the chain invalid
+        return position
+
+    return None
+
+
+def check_transactions(block: dict, reward: float) -> bool:
+    """
+    Checks the shape of a block's transactions: one coinbase, first, paying `reward` plus the block's fees,
+    then transfers of a positive amount with a fee and a signature. The signatures and the balances are
+    checked by the caller, they need keys and state this function doesn't have
+    :param reward: <float> What a block earns its miner besides the fees
+    :return: <bool> True if valid, False otherwise
+    """
+    try:
+        coinbase, transfers = block['transactions'][0], block['transactions'][1:]
+        if coinbase['sender'] != "0" or not isinstance(coinbase['recipient'], str):
+            return False
+
+        for t in transfers:
+            amount, fee = t['amount'], t.get('fee', 0.0)
+            if t['sender'] == "0" or not all(isinstance(t.get(k), str) for k in ('sender', 'recipient', 'signature')):
+                return False
+            if any(isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value)
+                   for value in (amount, fee)):
+                return False
+            if amount <= 0 or fee < 0:
+                return False
+
+        #the fees are summed in block order, as the miner did, but a peer's float rounding is tolerated
+        return abs(coinbase['amount'] - (reward + sum(t.get('fee', 0.0) for t in transfers))) <= 1e-9
+
+    except (KeyError, TypeError, IndexError):
+        return False
+
+
+def check_balances(blocks: list[dict], balances: dict[str, float]) -> int | None:
+    """
+    Applies blocks to balances in order, the way they were mined: each sender's amount and fee are debited
+    only if its balance covers them, then the block's recipients are credited
+    :param balances: <dict> Balances before blocks[0], updated in place. Wallets missing from it hold nothing
+    :return: <int> Position of the first block which overdraws a wallet, or None if none does
+    """
+    for position, block in enumerate(blocks):
+        for t in block['transactions']:
+            if t['sender'] == "0":
+                continue
+            total = t['amount'] + t.get('fee', 0.0)
+            if balances.get(t['sender'], 0.0) < total:
+                return position
+            balances[t['sender']] -= total
+
+        for t in block['transactions']:
+            balances[t['recipient']] = balances.get(t['recipient'], 0.0) + t['amount']
+
+    return None
+
+
+class ChainValidator(object):
+    """
+    Splits a chain into chunks and checks them in worker processes. Each chunk only needs the blocks just
+    before it, so the chunks are independent, and the first invalid block wins.
+    """
+
+    def __init__(self, workers: int | None = None, chunk_size: int = VALIDATION_CHUNK_SIZE):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self._executor: ProcessPoolExecutor | None = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def first_invalid(self, chain: list[dict], previous: list[dict] | None = None) -> int | None:
+        """
+        Finds the first invalid block of a chain
+        :param chain: <list> A blockchain, or the part of one which follows `previous`
+        :param previous: <list> Trusted blocks just before chain[0]. Unless chain starts near the genesis block
+                         it needs at least RETARGET_INTERVAL of them to check the difficulty
+        :return: <int> Position in `chain` of the first invalid block, or None if the chain is valid
+        """
+
+        if not chain:
+            return 0
+
+        loop = asyncio.get_running_loop()
+        blocks = (previous or []) + chain
+        offset = len(previous or [])
+        genesis = offset == 0
+
+        #short chains are checked in a thread, which keeps the event loop free without the pickling cost
+        if len(chain) <= self.chunk_size:
+            position = await loop.run_in_executor(None, check_range, blocks, offset, genesis)
+            return None if position is None else position - offset
+
+        #maps each task to the position of its slice in blocks and of its first checked block
+        chunks: dict[asyncio.Future, tuple[int, int]] = {}
+        for start in range(offset, len(blocks), self.chunk_size):
+            low = max(0, start - RETARGET_INTERVAL)
+            future = loop.run_in_executor(
+                self.executor, check_range, blocks[low:start + self.chunk_size], start - low, genesis and low == 0
+            )
+            chunks[future] = (low, start)
+
+        first_bad: int | None = None
+        pending = set(chunks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    position = future.result()
+                    if position is not None:
+                        position += chunks[future][0]
+                        if first_bad is None or position < first_bad:
+                            first_bad = position
+
+                if first_bad is not None:
+                    #chunks after the failure can't change the answer, only earlier ones still matter
+                    for future in [f for f in pending if chunks[f][1] > first_bad]:
+                        future.cancel()
+                        pending.discard(future)
+        finally:
+            for future in pending:
+                future.cancel()
+
+        return None if first_bad is None else first_bad - offset
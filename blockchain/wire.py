@@ -0,0 +1,241 @@
+"""This python file contains the compact binary encoding of chain pages exchanged between peers"""
+import struct
+from datetime import datetime, timezone
+
+from encoding import time_format, parse_time
+
+#Media type of the binary encoding, peers ask for it in their Accept header
+CHAIN_MEDIA_TYPE = "application/x-blockchain-chain"
+
+#Every payload starts with this, so a stray JSON body is never mistaken for a chain
+MAGIC = b"BCW1"
+
+#Frame types: a dictionary key, a block, and the end of the page with its length and next_index
+KEY_FRAME = b"K"
+BLOCK_FRAME = b"B"
+END_FRAME = b"E"
+
+#How a string field is packed: absent, as the raw bytes of a lowercase hex string, as UTF-8, or for
+#timestamps as seconds since the epoch
+NONE, HEX, TEXT, EPOCH = 0, 1, 2, 3
+
+U8 = struct.Struct(">B")
+U16 = struct.Struct(">H")
+U32 = struct.Struct(">I")
+I64 = struct.Struct(">q")
+F64 = struct.Struct(">d")
+
+#The fixed size start of a transaction: sender and recipient key ids, amount, fee, then the signature
+TRANSACTION = struct.Struct(">IIdd")
+
+
+def _pack_bytes(data: bytes) -> bytes:
+    return U32.pack(len(data)) + data
+
+
+def _pack_string(value: str | None) -> bytes:
+    """
+    Hashes and signatures are hex, so they are sent as the bytes they spell out, at half the size
+    """
+    if value is None:
+        return U8.pack(NONE)
+
+    if len(value) % 2 == 0:
+        try:
+            raw = bytes.fromhex(value)
+        except ValueError:
+            raw = None
+        if raw is not None and raw.hex() == value:
+            return U8.pack(HEX) + _pack_bytes(raw)
+
+    return U8.pack(TEXT) + _pack_bytes(value.encode())
+
+
+def _pack_int(value: int) -> bytes:
+    #proofs and difficulties have no fixed bound, so they are sent with their byte length
+    raw = value.to_bytes(max(1, (value.bit_length() + 7) // 8), 'big')
+    return U8.pack(len(raw)) + raw
+
+
+def _pack_time(value: str | None) -> bytes:
+    try:
+        parsed = parse_time(value)
+    except (TypeError, ValueError):
+        parsed = None
+
+    if parsed is not None and time_format(parsed) == value:
+        return U8.pack(EPOCH) + I64.pack(int(parsed.replace(tzinfo=timezone.utc).timestamp()))
+    return _pack_string(value)
+
+
+class ChainEncoder(object):
+    """
+    Encodes blocks as frames. Sender and recipient keys are written once, in a key frame, and referred to
+    by their position from then on, since the same few wallets appear in most transactions.
+    """
+
+    def __init__(self):
+        self._keys: dict[str, int] = {}
+
+    def encode(self, blocks: list[dict], length: int, next_index: int | None) -> bytes:
+        """
+        :param blocks: <list> Blocks in their dict form
+        :param length: <int> Our chain's length
+        :param next_index: <int> Index of the next page, or None if this is the last one
+        :return: <bytes> The whole payload
+        """
+        frames = [MAGIC]
+        for block in blocks:
+            frames.append(self._encode_block(block, frames))
+        frames.append(END_FRAME + U32.pack(length) + I64.pack(-1 if next_index is None else next_index))
+        return b"".join(frames)
+
+    def _key(self, key: str, frames: list[bytes]) -> int:
+        if key not in self._keys:
+            self._keys[key] = len(self._keys)
+            frames.append(KEY_FRAME + _pack_bytes(key.encode()))
+        return self._keys[key]
+
+    def _encode_block(self, block: dict, frames: list[bytes]) -> bytes:
+        parts = [
+            BLOCK_FRAME,
+            U32.pack(block['index']),
+            _pack_string(block.get('hash')),
+            _pack_time(block.get('timestamp')),
+            _pack_int(block['proof']),
+            _pack_string(block['previous_hash']),
+            _pack_int(block['difficulty']),
+            _pack_string(block.get('merkle_root')),
+            U32.pack(len(block['transactions'])),
+        ]
+        for t in block['transactions']:
+            parts.append(TRANSACTION.pack(self._key(t['sender'], frames), self._key(t['recipient'], frames),
+                                          t['amount'], t.get('fee', 0.0)))
+            parts.append(_pack_string(t.get('signature')))
+        return b"".join(parts)
+
+
+class Incomplete(Exception):
+    """
+    Raised inside the decoder when the buffer ends partway through a frame
+    """
+
+
+class ChainDecoder(object):
+    """
+    Decodes a payload as it arrives: feed() takes each chunk and returns the blocks it completed, so
+    blocks can be handled while the rest is still downloading
+    """
+
+    def __init__(self):
+        self.length: int | None = None
+        self.next_index: int | None = None
+        self.finished = False
+        self._buffer = bytearray()
+        self._position = 0
+        self._keys: list[str] = []
+        self._started = False
+
+    def feed(self, data: bytes) -> list[dict]:
+        """
+        :return: <list> The blocks completed by this chunk
+        :raises ValueError: if the payload is malformed
+        """
+        self._buffer += data
+        blocks = []
+
+        while not self.finished:
+            start = self._position
+            try:
+                if not self._started:
+                    if self._take(len(MAGIC)) != MAGIC:
+                        raise ValueError("Not a chain payload")
+                    self._started = True
+                    continue
+
+                frame = self._take(1)
+                if frame == KEY_FRAME:
+                    self._keys.append(self._bytes().decode())
+                elif frame == BLOCK_FRAME:
+                    blocks.append(self._block())
+                elif frame == END_FRAME:
+                    self.length = self._unpack(U32)
+                    next_index = self._unpack(I64)
+                    self.next_index = None if next_index < 0 else next_index
+                    self.finished = True
+                else:
+                    raise ValueError("Unknown frame")
+            except Incomplete:
+                self._position = start
+                break
+
+        #consumed frames are dropped, so the buffer only ever holds one partial frame
+        del self._buffer[:self._position]
+        self._position = 0
+        return blocks
+
+    def _take(self, size: int) -> bytes:
+        if self._position + size > len(self._buffer):
+            raise Incomplete()
+        data = bytes(self._buffer[self._position:self._position + size])
+        self._position += size
+        return data
+
+    def _unpack_all(self, fmt: struct.Struct) -> tuple:
+        if self._position + fmt.size > len(self._buffer):
+            raise Incomplete()
+        values = fmt.unpack_from(self._buffer, self._position)
+        self._position += fmt.size
+        return values
+
+    def _unpack(self, fmt: struct.Struct):
+        return self._unpack_all(fmt)[0]
+
+    def _bytes(self) -> bytes:
+        return self._take(self._unpack(U32))
+
+    def _string(self) -> str | None:
+        kind = self._unpack(U8)
+        if kind == NONE:
+            return None
+        if kind == HEX:
+            return self._bytes().hex()
+        if kind == TEXT:
+            return self._bytes().decode()
+        raise ValueError("Unknown string encoding")
+
+    def _int(self) -> int:
+        return int.from_bytes(self._take(self._unpack(U8)), 'big')
+
+    def _time(self) -> str | None:
+        if self._buffer[self._position:self._position + 1] == U8.pack(EPOCH):
+            self._position += 1
+            return time_format(datetime.fromtimestamp(self._unpack(I64), timezone.utc))
+        return self._string()
+
+    def _block(self) -> dict:
+        block = {
+            "index": self._unpack(U32),
+            "hash": self._string(),
+            "timestamp": self._time(),
+            "proof": self._int(),
+            "previous_hash": self._string(),
+            "difficulty": self._int(),
+            "merkle_root": self._string(),
+        }
+
+        keys = self._keys
+        transactions = []
+        for _ in range(self._unpack(U32)):
+            sender, recipient, amount, fee = self._unpack_all(TRANSACTION)
+            if sender >= len(keys) or recipient >= len(keys):
+                raise ValueError("Unknown key")
+            transactions.append({
+                "sender": keys[sender],
+                "recipient": keys[recipient],
+                "amount": amount,
+                "fee": fee,
+                "signature": self._string(),
+            })
+        block['transactions'] = transactions
+        return block